@@ -1,6 +1,6 @@
 
 """
-Install a NeXus file writer for uascan raw data files
+Install NeXus file writers for uascan and fly scan raw data files
 
 See ``instrument.utils.setup_new_user.newFile()``
 to replace ``instrument.framework.callbacks.newSpecFile()``
@@ -8,14 +8,20 @@ to replace ``instrument.framework.callbacks.newSpecFile()``
 
 __all__ = [
     "nxwriter",
+    "nxwriter_flyscan",
     ]
 
 # from ..session_logs import logger
 from instrument.session_logs import logger
 logger.info(__file__)
 
+from .nxwriter_usaxs import NXWriterFlyScan
 from .nxwriter_usaxs import NXWriterUascan
 from ..framework import RE, callback_db
 
 nxwriter = NXWriterUascan()
 callback_db['nxwriter'] = RE.subscribe(nxwriter.receiver)
+
+# adds the bluesky run to the file written by usaxs_flyscan
+nxwriter_flyscan = NXWriterFlyScan()
+callback_db['nxwriter_flyscan'] = RE.subscribe(nxwriter_flyscan.receiver)
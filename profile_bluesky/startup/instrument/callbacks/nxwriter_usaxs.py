@@ -7,7 +7,7 @@ to replace ``instrument.framework.callbacks.newSpecFile()``
 """
 
 __all__ = [
-    # "NXWriterFlyScan",    # not yet tested
+    "NXWriterFlyScan",
     "NXWriterUascan",
     # "NXWriterSaxsWaxs",    # not yet tested
     ]
@@ -16,10 +16,16 @@ from ..session_logs import logger
 logger.info(__file__)
 
 from apstools.filewriters import NXWriterAPS
+from apstools.utils import run_in_thread
+import copy
+import h5py
 import numpy as np
 import os
 
+from usaxs_support.flyscan_handler import FLYSCAN_HDF5_SPEC
+
 from ..devices import terms
+from ..devices import usaxs_flyscan
 from ..devices.user_data import user_data
 from ..utils.cleanup_text import cleanupText
 from ..utils.setup_new_user import techniqueSubdirectory
@@ -145,8 +151,85 @@ class OurCustomNXWriterBase(NXWriterAPS):
         return text.encode("utf8")
 
 class NXWriterFlyScan(OurCustomNXWriterBase):
+    """
+    add the bluesky run to the fly scan file written by ``SaveFlyScan``
+
+    The fly scan data is written once, by ``usaxs_flyscan`` (``SaveFlyScan``).
+    This writer adds the bluesky metadata and streams to that same
+    file, as ``/entry/instrument/bluesky``.  The ``mca`` stream
+    (datums referencing ``/entry/flyScan``) is linked, not copied.
+
+    The fly scan file is finished in a background thread
+    (``usaxs_flyscan.hdf5_file_status``).  This writer waits for that,
+    also in a background thread, so the RunEngine continues.
+    """
 
     supported_plans = ("Flyscan", )
+    timeout_s = 120     # wait for the fly scan file to finish
+
+    def start(self, doc):
+        super().start(doc)
+        # usaxs_flyscan chooses the name (might use a fallback name)
+        self.file_name = None
+
+    def writer(self):
+        "add this run to the fly scan file, when that file is finished"
+        plan = self.metadata.get("plan_name")
+        if plan not in self.supported_plans:
+            return
+
+        fname = usaxs_flyscan._output_HDF5_file_
+        if fname is None:
+            logger.warning("No fly scan file to add the bluesky run.")
+            return
+        # clear() (at the next start()) replaces, does not modify, what we collected
+        job = copy.copy(self)
+        job.file_name = fname
+        job.write_fly_scan_file(usaxs_flyscan.hdf5_file_status)
+
+    @run_in_thread
+    def write_fly_scan_file(self, status):
+        try:
+            status.wait(timeout=self.timeout_s)
+        except Exception as exc:
+            logger.error(
+                "Fly scan file not finished, bluesky run not added: %s %s",
+                self.file_name, exc)
+            return
+
+        with h5py.File(self.file_name, "r+") as self.root:
+            nxinstrument = self.root["/entry/instrument"]
+            bluesky_group = self.create_NX_group(nxinstrument, "bluesky:NXnote")
+            md_group = self.write_metadata(bluesky_group)
+            self.write_streams(bluesky_group)
+            bluesky_group["uid"] = md_group["run_start_uid"]
+            bluesky_group["plan_name"] = md_group["plan_name"]
+
+        self.root = None
+        logger.info("added bluesky run to fly scan file: %s", self.file_name)
+        self.output_nexus_file = self.file_name
+
+    def getResourceFile(self, resource_id):
+        resource = self.externals[resource_id]
+        if resource["spec"] != FLYSCAN_HDF5_SPEC:
+            return super().getResourceFile(resource_id)
+        return os.path.join(resource["root"], resource["resource_path"])
+
+    def write_stream_external(self, parent, d, subgroup, stream_name, k, v):
+        datum = self.externals[d[0]]
+        resource_id = datum["resource"]
+        if self.externals[resource_id]["spec"] != FLYSCAN_HDF5_SPEC:
+            super().write_stream_external(parent, d, subgroup, stream_name, k, v)
+            return
+
+        # link, do not copy, the array written by SaveFlyScan
+        fname = self.getResourceFile(resource_id)
+        address = datum["datum_kwargs"]["address"]
+        if os.path.abspath(fname) == os.path.abspath(self.file_name):
+            subgroup["value"] = self.root[address]
+        else:
+            subgroup["value"] = h5py.ExternalLink(fname, address)
+        subgroup.attrs["signal"] = "value"
 
     def write_streams(self, parent):
         "write all bluesky document streams in this run"
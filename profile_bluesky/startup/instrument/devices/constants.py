@@ -18,4 +18,7 @@ constants = {
     "USAXS_AY_OFFSET" : 8, # USAXS transmission diode AY offset, calibrated by JIL 2018/04/10 For Delhi crystals diode is between 5 - 10 mm .. center is 8mm
     "MEASURE_DARK_CURRENTS" : True, # MEASURE dark currents on start of data collection
     "SYNC_ORDER_NUMBERS" : True, # sync order numbers among devices on start of collect data sequence
+    "FLYSCAN_MIN_QUALITY" : 0.95, # fly scan data integrity score (0..1) below this is a bad fly scan
+    "FLYSCAN_BUILD_TRAJECTORIES" : False, # compute & upload fly scan trajectories in bluesky (from terms), not EPICS
+    "FLYSCAN_MAX_RETRIES" : 0, # re-run a bad fly scan this many times (waits for each fly scan file, to check it), 0: no checks, files are written during the next scan
 }
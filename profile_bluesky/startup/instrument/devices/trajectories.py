@@ -1,4 +1,3 @@
-
 """
 USAXS Fly Scan trajectories
 """
@@ -10,8 +9,16 @@ __all__ = [
 from ..session_logs import logger
 logger.info(__file__)
 
+from bluesky import plan_stubs as bps
 from ophyd import Component, Device, EpicsSignal
 
+from usaxs_support.flyscan_trajectory import compute_trajectories
+
+from .general_terms import terms
+from .monochromator import monochromator
+from .stages import as_stage
+from ..utils.a2q_q2a import q2angle
+
 
 class Trajectories(Device):
     """fly scan trajectories"""
@@ -20,4 +27,90 @@ class Trajectories(Device):
     dy = Component(EpicsSignal, "9idcLAX:traj2:M1Traj")
     num_pulse_positions = Component(EpicsSignal, "9idcLAX:traj1:NumPulsePositions")
 
+    ar_num_elements = Component(EpicsSignal, "9idcLAX:traj1:NumElements")
+    ay_num_elements = Component(EpicsSignal, "9idcLAX:traj3:NumElements")
+    dy_num_elements = Component(EpicsSignal, "9idcLAX:traj2:NumElements")
+    ar_build = Component(EpicsSignal, "9idcLAX:traj1:Build", put_complete=True)
+    ay_build = Component(EpicsSignal, "9idcLAX:traj3:Build", put_complete=True)
+    dy_build = Component(EpicsSignal, "9idcLAX:traj2:Build", put_complete=True)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.uploaded_parameters = None    # parameters of the uploaded trajectories
+
+    def parameters(self):
+        """
+        trajectory parameters (tuple), from ``terms.USAXS`` and ``terms.FlyScan``
+
+        The AR range is the same as ``USAXSscan()``.
+        """
+        center = terms.USAXS.ar_val_center.get()
+        wavelength = monochromator.dcm.wavelength.get()
+        start = center - q2angle(terms.USAXS.start_offset.get(), wavelength)
+        finish = center - q2angle(terms.USAXS.finish.get(), wavelength)
+        asrp = (None, None)
+        if terms.USAXS.useSBUSAXS.get():
+            asrp = (as_stage.rp.position, terms.USAXS.asrp_degrees_per_VDC.get())
+        return (
+            float(start),
+            float(center),
+            float(finish),
+            int(terms.FlyScan.number_points.get()),
+            terms.USAXS.uaterm.get(),
+            terms.USAXS.usaxs_minstep.get(),
+            terms.USAXS.AY0.get(),
+            terms.USAXS.SAD.get(),
+            terms.USAXS.DY0.get(),
+            terms.USAXS.SDD.get(),
+            *asrp,
+        )
+
+    def compute(self, parameters=None):
+        """
+        compute (or get from cache) the trajectories, dict of arrays
+
+        :param tuple parameters: from ``parameters()`` (default)
+        """
+        return compute_trajectories(*(parameters or self.parameters()))
+
+    def upload(self, parameters=None):
+        """
+        plan: compute the trajectories and write them to EPICS, when changed
+
+        Nothing is written when ``parameters`` are the same as last
+        uploaded (by this session) and EPICS still has as many
+        elements (someone else may have uploaded since).
+        The ASRP trajectory (side-bounce) is not uploaded,
+        ASRP follows AR in EPICS (``terms.FlyScan.asrp_calc_SCAN``).
+
+        :param tuple parameters: from ``parameters()`` (default)
+        """
+        parameters = parameters or self.parameters()
+        trajectories = self.compute(parameters)
+        n = len(trajectories["ar"])
+        if parameters == self.uploaded_parameters and self._num_elements_match(n):
+            logger.debug("fly scan trajectories unchanged, not uploaded")
+            return
+        self.uploaded_parameters = None     # in case upload fails
+        yield from bps.mv(
+            self.ar, trajectories["ar"],
+            self.ay, trajectories["ay"],
+            self.dy, trajectories["dy"],
+            self.ar_num_elements, n,
+            self.ay_num_elements, n,
+            self.dy_num_elements, n,
+        )
+        yield from bps.mv(
+            self.ar_build, 1,
+            self.ay_build, 1,
+            self.dy_build, 1,
+        )
+        self.uploaded_parameters = parameters
+        logger.info("uploaded fly scan trajectories: %d points", n)
+
+    def _num_elements_match(self, n):
+        """do the (EPICS) trajectories have ``n`` elements?"""
+        signals = (self.ar_num_elements, self.ay_num_elements, self.dy_num_elements)
+        return all(signal.get() == n for signal in signals)
+
 flyscan_trajectories = Trajectories(name="flyscan_trajectories")
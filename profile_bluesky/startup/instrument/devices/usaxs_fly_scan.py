@@ -8,18 +8,23 @@ __all__ = ["usaxs_flyscan",]
 from ..session_logs import logger
 logger.info(__file__)
 
-from apstools.synApps.busy import BusyStatus
 from apstools.plans import addDeviceDataAsStream
+from apstools.synApps.busy import BusyStatus
 from apstools.utils import run_in_thread
+import asyncio
 from bluesky import plan_stubs as bps
+from collections import deque
 from collections import OrderedDict
 import datetime
+from event_model import compose_resource
 from ophyd import Component, Device, EpicsSignal, Signal
 from ophyd.status import Status
 import os
 import time
 import uuid
 
+from usaxs_support.flyscan_handler import FLYSCAN_HDF5_SPEC
+from usaxs_support.flyscan_master import FlyScanMasterFile, FLYSCAN_MASTER_FILE
 from usaxs_support.saveFlyData import SaveFlyScan
 # NOTES for testing SaveFlyScan() command
 """
@@ -29,6 +34,7 @@ sfs.saveFile()
 """
 
 from ..framework import RE, specwriter
+from ..utils.reporter import progress_reporter
 from .amplifiers import upd_controls, AutorangeSettings
 from .general_terms import terms
 from .scalers import use_EPICS_scaler_channels
@@ -41,18 +47,89 @@ from .user_data import user_data
 FALLBACK_DIR = "/share1/USAXS_data"
 
 
+class FlyScanArrayReferences:
+    """
+    (readable) fly scan arrays, as references into the fly scan HDF5 file
+
+    The arrays are written once, to the HDF5 file, by ``SaveFlyScan``.
+    Reading this object returns datum ids.  The resource and
+    datum documents come from ``collect_asset_docs()``.  Databroker
+    loads the arrays with ``usaxs_support.flyscan_handler.FlyScanHDF5Handler``.
+
+    EXAMPLE::
+
+        mca_refs.set_file(hdf5_file, struck.current_channel.get())
+        yield from addDeviceDataAsStream(mca_refs, "mca")
+    """
+
+    def __init__(self, name, arrays):
+        self.name = name
+        self.parent = None
+        self.arrays = arrays    # {key: HDF5 address}
+        self._asset_docs_cache = deque()
+        self._description = {}
+        self._reading = {}
+
+    def set_file(self, hdf5_file, num_channels):
+        """compose the resource and datum documents for this fly scan file"""
+        bundle = compose_resource(
+            spec=FLYSCAN_HDF5_SPEC,
+            root=os.path.dirname(hdf5_file),
+            resource_path=os.path.basename(hdf5_file),
+            resource_kwargs={},
+            start={"uid": "needed for compose_resource() but will be discarded"},
+        )
+        resource = bundle.resource_doc
+        resource.pop("run_start")   # the RunEngine adds this
+        self._asset_docs_cache.clear()
+        self._asset_docs_cache.append(("resource", resource))
+
+        t = time.time()
+        self._description = {}
+        self._reading = {}
+        for key, address in self.arrays.items():
+            datum = bundle.compose_datum(datum_kwargs=dict(address=address))
+            self._asset_docs_cache.append(("datum", datum))
+            self._description[key] = dict(
+                source=f"{FLYSCAN_HDF5_SPEC}:{address}",
+                dtype="array",
+                shape=[num_channels],
+                external="FILESTORE:",
+            )
+            self._reading[key] = dict(value=datum["datum_id"], timestamp=t)
+
+    def collect_asset_docs(self):
+        items = list(self._asset_docs_cache)
+        self._asset_docs_cache.clear()
+        yield from items
+
+    def describe(self):
+        return OrderedDict(self._description)
+
+    def read(self):
+        return OrderedDict(self._reading)
+
+    def describe_configuration(self):
+        return OrderedDict()
+
+    def read_configuration(self):
+        return OrderedDict()
+
+
 class UsaxsFlyScanDevice(Device):
     busy = Component(EpicsSignal, '9idcLAX:USAXSfly:Start', string=True, put_complete=True)
     scan_time = Component(EpicsSignal, "9idcLAX:USAXS:FS_ScanTime")
     num_points = Component(EpicsSignal, "9idcLAX:USAXS:FS_NumberOfPoints")
     flying = Component(Signal, value=False)
     timeout_s = 120
+    hdf5_finish_timeout_s = 120     # wait for previous HDF5 file
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.t0 = None
         self.update_time = None
         self.update_interval_s = 5
+        self.publish_interval_s = 1     # terms.FlyScan.elapsed_time updates
         self.ar0 = None
         self.ay0 = None
         self.dy0 = None
@@ -61,10 +138,59 @@ class UsaxsFlyScanDevice(Device):
         self.saveFlyData_HDF5_dir ="/tmp"
         self.fallback_dir = FALLBACK_DIR
         self.saveFlyData_HDF5_file ="sfs.h5"
+        self.saveFlyData_streaming = False  # True: write MCA data during the scan
+        self.saveFlyData_writer = None  # usaxs_support.hdf5_writer.HDF5WriterService(): h5py calls in another process
+        self.saveFlyData_reduce = False  # True: write R(Q) into the file when it is closed
+        self.saveFlyData_master_file = FLYSCAN_MASTER_FILE  # session index, None: do not write
+        self.mca_references = FlyScanArrayReferences(
+            "mca",
+            {f"mca{i}": f"/entry/flyScan/mca{i}" for i in (1, 2, 3)})
+        self.hdf5_file_status = Status()    # done when the HDF5 file is closed
+        self.hdf5_file_status.set_finished()
+        self.hdf5_file_quality = None   # data integrity of the last HDF5 file
         self._output_HDF5_file_ = None
         self.flying._status = Status()  # issue #501
         self.flying._status.set_finished()
 
+    def wait_HDF5_file_finished(self, timeout=None):
+        """
+        (plan) wait until the previous fly scan HDF5 file is finished
+
+        The HDF5 file is finished (closed, added to the master file)
+        in a background thread while the plans continue.  The next
+        fly scan must not start a new file before then.
+        """
+        status = self.hdf5_file_status
+        if status.done:
+            return
+        timeout = timeout or self.hdf5_finish_timeout_s
+        logger.info(f"waiting for HDF5 file to finish: {self._output_HDF5_file_}")
+
+        def status_finished():
+            """awaitable (in the RunEngine loop): done when status is done"""
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+
+            def finished(st):
+                loop.call_soon_threadsafe(
+                    lambda: future.done() or future.set_result(None))
+
+            status.add_callback(finished)   # called now if already done
+            return future
+
+        t0 = time.time()
+        try:
+            yield from bps.wait_for([status_finished], timeout=timeout)
+        except TimeoutError as exc:
+            raise TimeoutError(
+                f"HDF5 file not finished after {timeout} s:"
+                f" {self._output_HDF5_file_}"
+            ) from exc
+        logger.debug(f"waited {time.time() - t0:.3f}s for HDF5 file")
+        if not status.success:
+            # already reported by finish_HDF5_file(), next fly scan can proceed
+            logger.error(f"HDF5 file not finished: {status.exception()}")
+
     def plan(self, md={}):
         """
         run the USAXS fly scan
@@ -72,10 +198,10 @@ class UsaxsFlyScanDevice(Device):
         bluesky_runengine_running = RE.state != "idle"
 
         def _report_(t):
-            elapsed = struck.elapsed_real_time.get()
+            elapsed = progress_reporter.value(struck.elapsed_real_time)
             channel = None
             if elapsed is not None:
-                channel = struck.current_channel.get()
+                channel = progress_reporter.value(struck.current_channel)
                 if elapsed > t:     # looking at previous fly scan
                     elapsed = 0
                     channel = 0
@@ -97,30 +223,64 @@ class UsaxsFlyScanDevice(Device):
             # values.append(resource_usage())
             return "  ".join([f"{s:11}" for s in values])
 
-        @run_in_thread
         def progress_reporting():
+            """
+            report progress of this fly scan (with the session progress_reporter)
+
+            Driven by monitors (flying, struck elapsed time) and timers,
+            no polling.  Ends when flying is False, or after the timeout.
+            """
             logger.debug("progress_reporting has arrived")
-            t = time.time()
-            timeout = t + self.scan_time.get() + self.timeout_s # extra padded time
-            startup = t + self.update_interval_s/2
-            while t < startup and not self.flying.get():    # wait for flyscan to start
-                time.sleep(0.01)
+            progress_reporter.watch(struck.elapsed_real_time)
+            progress_reporter.watch(struck.current_channel)
             labels = ("flying, s", "ar, deg", "ay, mm", "dy, mm", "channel", "elapsed, s")
             logger.info("  ".join([f"{s:11}" for s in labels]))
-            while t < timeout and self.flying.get():
-                if t > self.update_time:
-                    self.update_time = t + self.update_interval_s
-                    msg = _report_(t - self.t0)
-                    logger.debug(msg)
-                time.sleep(0.01)
-                t = time.time()
-            msg = _report_(time.time() - self.t0)
-            logger.info(msg)
-            # user_data.set_state_blocking(msg.split()[0])
-            if t > timeout:
-                logger.error(f"{time.time()-self.t0}s - progress_reporting timeout!!")
-            else:
-                logger.debug(f"{time.time()-self.t0}s - progress_reporting is done")
+            timers = dict(update=None, timeout=None)
+            subscriptions = {}
+
+            def update():
+                msg = _report_(time.time() - self.t0)
+                logger.debug(msg)
+                timers["update"] = progress_reporter.call_later(self.update_interval_s, update)
+
+            def finish(timed_out=False):
+                if len(subscriptions) == 0:
+                    return      # already finished
+                for signal, cid in subscriptions.items():
+                    signal.unsubscribe(cid)
+                subscriptions.clear()
+                for handle in timers.values():
+                    progress_reporter.cancel(handle)
+                progress_reporter.cancel_throttle("flyscan elapsed")
+                msg = _report_(time.time() - self.t0)
+                logger.info(msg)
+                progress_reporter.unwatch(struck.elapsed_real_time)
+                progress_reporter.unwatch(struck.current_channel)
+                # user_data.set_state_blocking(msg.split()[0])
+                if timed_out:
+                    logger.error(f"{time.time()-self.t0}s - progress_reporting timeout!!")
+                else:
+                    logger.debug(f"{time.time()-self.t0}s - progress_reporting is done")
+
+            def publish_elapsed(elapsed):
+                terms.FlyScan.elapsed_time.put(elapsed)  # for our GUI display
+
+            def elapsed_cb(value=None, **kwargs):
+                if self.flying.get():
+                    progress_reporter.throttle(
+                        "flyscan elapsed", self.publish_interval_s, publish_elapsed, value)
+
+            def flying_cb(old_value=None, value=None, **kwargs):
+                if old_value and not value:     # fly scan has ended
+                    progress_reporter.call_soon(finish)
+
+            subscriptions[self.flying] = self.flying.subscribe(flying_cb, run=False)
+            subscriptions[struck.elapsed_real_time] = struck.elapsed_real_time.subscribe(
+                elapsed_cb, run=False)
+            timers["update"] = progress_reporter.call_at(self.update_time, update)
+            timers["timeout"] = progress_reporter.call_later(
+                self.scan_time.get() + self.timeout_s,  # extra padded time
+                finish, True)
 
         @run_in_thread
         def prepare_HDF5_file():
@@ -151,19 +311,44 @@ class UsaxsFlyScanDevice(Device):
             # logger.debug(resource_usage("before SaveFlyScan()"))
             self.saveFlyData = SaveFlyScan(
                 fname,
-                config_file=self.saveFlyData_config)
+                config_file=self.saveFlyData_config,
+                streaming=self.saveFlyData_streaming,
+                writer=self.saveFlyData_writer,
+                reduce=self.saveFlyData_reduce)
             # logger.debug(resource_usage("before saveFlyData.preliminaryWriteFile()"))
             self.saveFlyData.preliminaryWriteFile()
             # logger.debug(resource_usage("after saveFlyData.preliminaryWriteFile()"))
 
-        @run_in_thread
-        def finish_HDF5_file():
-            if self.saveFlyData is None:
-                raise RuntimeError("Must first call prepare_HDF5_file()")
-            self.saveFlyData.saveFile()
+        def add_to_master_file(hdf5_file):
+            # in the same directory as the fly scan file
+            master = FlyScanMasterFile(
+                os.path.join(
+                    os.path.dirname(hdf5_file),
+                    self.saveFlyData_master_file))
+            try:
+                master.add_scan(hdf5_file)
+            except Exception as exc:
+                # the fly scan file is complete, do not fail the scan
+                logger.error(f"Could not add {hdf5_file} to {master.master_file}: {exc}")
 
-            logger.info(f"HDF5 output complete: {self._output_HDF5_file_}")
-            self.saveFlyData = None
+        @run_in_thread
+        def finish_HDF5_file(status, prepare_thread):
+            try:
+                prepare_thread.join()
+                # take this file from the device, next fly scan prepares its own
+                sfs, self.saveFlyData = self.saveFlyData, None
+                if sfs is None:
+                    raise RuntimeError("Must first call prepare_HDF5_file()")
+                sfs.saveFile()
+                self.hdf5_file_quality = sfs.quality
+
+                logger.info(f"HDF5 output complete: {sfs.hdf5_file_name}")
+                if self.saveFlyData_master_file is not None:
+                    add_to_master_file(sfs.hdf5_file_name)
+                status.set_finished()
+            except Exception as exc:
+                status.set_exception(exc)
+                raise
 
         ######################################################################
         # plan starts here
@@ -174,6 +359,10 @@ class UsaxsFlyScanDevice(Device):
         self.ay0 = a_stage.y.position
         self.dy0 = d_stage.y.position
 
+        # previous HDF5 file was finished in the background
+        yield from self.wait_HDF5_file_finished()
+        self.hdf5_file_quality = None
+
         _md = OrderedDict()
         _md.update(md or {})
         _md["hdf5_file"] = self.saveFlyData_HDF5_file
@@ -192,7 +381,7 @@ class UsaxsFlyScanDevice(Device):
             yield from bps.abs_set(self.flying, False)
 
         if bluesky_runengine_running:
-            prepare_HDF5_file()      # prepare HDF5 file to save fly scan data (background thread)
+            prepare_thread = prepare_HDF5_file()      # prepare HDF5 file to save fly scan data (background thread)
         # path = os.path.abspath(self.saveFlyData_HDF5_dir)
         specwriter._cmt("start", f"HDF5 configuration file: {self.saveFlyData_config}")
 
@@ -237,7 +426,10 @@ class UsaxsFlyScanDevice(Device):
                 # see: https://github.com/APS-USAXS/ipython-usaxs/issues/417
                 user_data.state._set_thread = None
             # logger.debug(resource_usage("before saveFlyData.finish_HDF5_file()"))
-            finish_HDF5_file()    # finish saving data to HDF5 file (background thread)
+            # finish saving data to HDF5 file (background thread)
+            # hdf5_file_status is done when the file is closed
+            self.hdf5_file_status = Status()
+            finish_HDF5_file(self.hdf5_file_status, prepare_thread)
             # logger.debug(resource_usage("after saveFlyData.finish_HDF5_file()"))
             specwriter._cmt("stop", f"finished {msg}")
             logger.info(f"finished {msg}")
@@ -250,8 +442,11 @@ class UsaxsFlyScanDevice(Device):
             ti_filter_shutter, "close",
             )
 
-        yield from addDeviceDataAsStream(
-            [struck.mca1, struck.mca2, struck.mca3], "mca")
+        if bluesky_runengine_running:
+            # MCA arrays are in the HDF5 file, the documents reference them
+            self.mca_references.set_file(
+                self._output_HDF5_file_, struck.current_channel.get())
+            yield from addDeviceDataAsStream(self.mca_references, "mca")
         logger.debug(f"after return: {time.time() - self.t0}s")
 
         yield from user_data.set_state_plan("fly scan finished")
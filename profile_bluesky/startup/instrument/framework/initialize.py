@@ -89,6 +89,10 @@ db = databroker.catalog["mongodb_config"].v1
 # If this is removed, data is not saved to metadatastore.
 callback_db["db"] = RE.subscribe(db.insert)
 
+# Load fly scan arrays referenced (Resource/Datum) in the fly scan HDF5 files.
+from usaxs_support.flyscan_handler import FLYSCAN_HDF5_SPEC, FlyScanHDF5Handler
+db.reg.register_handler(FLYSCAN_HDF5_SPEC, FlyScanHDF5Handler, overwrite=True)
+
 # Set up SupplementalData.
 sd = SupplementalData()
 RE.preprocessors.append(sd)
@@ -28,8 +28,8 @@ logger.info(__file__)
 from apstools.utils import ExcelDatabaseFileGeneric
 from apstools.utils import rss_mem
 from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
 from IPython import get_ipython
-from usaxs_support.nexus import reset_manager
 from usaxs_support.surveillance import instrument_archive
 import datetime
 import os
@@ -60,6 +60,7 @@ from ..devices.stages import s_stage
 
 
 MAXIMUM_ATTEMPTS = 1  # (>=1): try command list item no more than this many attempts
+FLYSCAN_ACTIONS = ("flyscan", "usaxsscan")  # back-to-back when consecutive, see FlyscanBatch
 
 
 def beforeScanComputeOtherStuff():
@@ -139,9 +140,9 @@ def before_command_list(md=None, commands=None):
     if commands is not None:
         yield from postCommandsListfile2WWW(commands)
 
-    # force the next FlyScan to reload the metadata configuration
-    # which forces a (re)connection to the EPICS PVs
-    reset_manager()
+    # The next FlyScan will reload the metadata configuration
+    # only if the XML file content has changed (see nexus.get_manager()).
+    # The EPICS PVs stay connected for the whole session.
 
 
 def verify_commands(commands):
@@ -421,13 +422,11 @@ def execute_command_list(filename, commands, md=None):
         contents from input file, such as:
         ``SAXS 0 0 0 blank``
     """
-    from .scans import preUSAXStune, SAXS, USAXSscan, WAXS
+    from .scans import flyscan_batch
 
     if md is None:
         md = {}
 
-    full_filename = os.path.abspath(filename)
-
     if len(commands) == 0:
         yield from bps.null()
         return
@@ -443,7 +442,24 @@ def execute_command_list(filename, commands, md=None):
     instrument_archive(text)
 
     yield from before_command_list(md=md, commands=commands)
-    for command in commands:
+    flyscan_batch.reset()
+    yield from bpp.finalize_wrapper(
+        _execute_commands_(filename, commands, md),
+        # consecutive fly scans leave the instrument configured, restore it
+        flyscan_batch.end,
+    )
+
+    yield from after_command_list(md=md)
+    logger.info("memory report: %s", rss_mem())
+
+
+def _execute_commands_(filename, commands, md):
+    """Plan: execute each command of the command list (see ``execute_command_list()``)."""
+    from .scans import flyscan_batch, preUSAXStune, SAXS, USAXSscan, WAXS
+
+    full_filename = os.path.abspath(filename)
+
+    for k, command in enumerate(commands):
         action, args, i, raw_command = command
         logger.info("file line %d: %s", i, raw_command)
 
@@ -458,6 +474,11 @@ def execute_command_list(filename, commands, md=None):
         _md.update(md or {})      # overlay with user-supplied metadata
 
         action = action.lower()
+        next_action = str(commands[k+1][0]).lower() if k+1 < len(commands) else None
+        flyscan_batch.next_is_flyscan = next_action in FLYSCAN_ACTIONS
+        if action not in FLYSCAN_ACTIONS:
+            yield from flyscan_batch.restore()
+
         simple_actions = dict(
             # command names MUST be lower case!
             # TODO: all these should accept a `md` kwarg
@@ -474,7 +495,7 @@ def execute_command_list(filename, commands, md=None):
 
         def _handle_actions_():
             """Inner function to make try..except clause more clear."""
-            if action in ("flyscan", "usaxsscan"):
+            if action in FLYSCAN_ACTIONS:
                 # handles either step or fly scan
                 sx = float(args[0])
                 sy = float(args[1])
@@ -552,9 +573,6 @@ def execute_command_list(filename, commands, md=None):
         if exit_requested:
             break
 
-    yield from after_command_list(md=md)
-    logger.info("memory report: %s", rss_mem())
-
 
 def sync_order_numbers():
     """
@@ -21,6 +21,8 @@ import datetime
 import os
 import time
 
+from usaxs_support import flyscan_validation
+
 from ..devices import a_stage, as_stage
 from ..devices import apsbss
 from ..devices import ar_start
@@ -250,6 +252,7 @@ def USAXSscan(x, y, thickness_mm, title, md=None):
     if terms.FlyScan.use_flyscan.get():
         yield from Flyscan(x, y, thickness_mm, title, md=_md)
     else:
+        yield from flyscan_batch.restore()
         yield from USAXSscanStep(x, y, thickness_mm, title, md=_md)
 
 
@@ -442,9 +445,171 @@ def USAXSscanStep(pos_X, pos_Y, thickness, scan_title, md=None):
     yield from after_plan(weight=3)
 
 
+class FlyscanBatch:
+    """
+    back-to-back fly scans (consecutive fly scans in a command list)
+
+    Consecutive fly scans use the same instrument configuration.
+    After each ``Flyscan()``, the settings are restored (scaler,
+    amplifier, autosave and mono feedback, ``restore_settings()``),
+    so the transmission of the next sample is measured as usual.
+    When ``execute_command_list()`` reports (``next_is_flyscan``)
+    that the next command is also a fly scan, only what the next
+    ``Flyscan()`` repeats is skipped: moving the stages back to
+    center (``teardown()``) and its setup (``mode_USAXS()``, slits).
+
+    The stages are moved back (``restore()``) before any other
+    command, before a tune, and when the command list ends (also
+    after an exception or an abort).
+    """
+
+    def __init__(self):
+        self.next_is_flyscan = False    # set by execute_command_list()
+        self.configured = False         # instrument left configured for fly scans
+        self.gains = None               # upd amplifier (gainU, gainD) to restore
+        self.setup_time = 0             # s, last setup()
+        self.teardown_time = 0          # s, last teardown()
+        self.skipped = 0                # setup & teardown skipped, since reset()
+
+    def reset(self):
+        """start a new command list"""
+        self.next_is_flyscan = False
+        self.skipped = 0
+
+    def setup(self):
+        """plan: prepare the instrument for a fly scan, if not already"""
+        if self.configured and terms.preUSAXStune.needed:
+            yield from self.teardown()      # tune from the usual configuration
+        if self.configured:
+            logger.debug("back-to-back fly scan: setup skipped")
+            yield from bps.null()
+            return
+
+        t0 = time.time()
+        yield from mode_USAXS()
+        yield from bps.mv(
+            usaxs_slit.v_size, terms.SAXS.usaxs_v_size.get(),
+            usaxs_slit.h_size, terms.SAXS.usaxs_h_size.get(),
+            guard_slit.v_size, terms.SAXS.usaxs_guard_v_size.get(),
+            guard_slit.h_size, terms.SAXS.usaxs_guard_h_size.get(),
+            timeout=MASTER_TIMEOUT,
+        )
+        self.setup_time = time.time() - t0
+
+    def finish(self, gains):
+        """
+        plan: after a fly scan, restore the settings and (unless the next is a fly scan) the stages
+
+        :param (float, float) gains: upd amplifier (gainU, gainD) before the fly scan
+        """
+        self.gains = gains
+        yield from self.restore_settings()
+        if self.next_is_flyscan and terms.FlyScan.use_flyscan.get():
+            self.configured = True
+            self.skipped += 1
+            logger.debug("back-to-back fly scan: teardown skipped")
+        else:
+            yield from self.teardown()
+
+    def restore(self):
+        """plan: move the stages back, if left configured for fly scans"""
+        if self.configured:
+            yield from self.teardown()
+        else:
+            yield from bps.null()
+
+    def restore_settings(self):
+        """plan: restore the scaler, amplifier, autosave & mono feedback settings"""
+        gain_up, gain_down = self.gains
+        yield from bps.mv(
+            lax_autosave.disable, 0,    # enable
+            lax_autosave.max_time, 0,   # start right away
+
+            ti_filter_shutter, "close",
+            monochromator.feedback.on, MONO_FEEDBACK_ON,
+            # user_data.collection_in_progress, 0,
+
+            scaler0.update_rate, 5,
+            scaler0.auto_count_delay, 0.25,
+            scaler0.delay, 0.05,
+            scaler0.preset_time, 1,
+            scaler0.auto_count_time, 1,
+
+            upd_controls.auto.gainU, gain_up,
+            upd_controls.auto.gainD, gain_down,
+            timeout=MASTER_TIMEOUT,
+            )
+
+    def teardown(self):
+        """plan: move the stages back to center after fly scan(s)"""
+        t0 = time.time()
+        yield from user_data.set_state_plan("Moving USAXS back and saving data")
+        yield from bps.mv(
+            a_stage.r, terms.USAXS.ar_val_center.get(),
+            a_stage.y, terms.USAXS.AY0.get(),
+            d_stage.y, terms.USAXS.DY0.get(),
+            timeout=MASTER_TIMEOUT,
+            )
+        self.configured = False
+        self.teardown_time = time.time() - t0
+
+    def end(self):
+        """plan: end of the command list, restore and report the time saved"""
+        self.next_is_flyscan = False
+        yield from self.restore()
+        if self.skipped > 0:
+            logger.info(
+                "back-to-back fly scans: skipped setup & teardown %d times,"
+                " saved about %.1f s (%.1f s per sample)",
+                self.skipped,
+                self.skipped * (self.setup_time + self.teardown_time),
+                self.setup_time + self.teardown_time,
+            )
+
+flyscan_batch = FlyscanBatch()
+
+
 def Flyscan(pos_X, pos_Y, thickness, scan_title, md=None):
     """
     do one USAXS Fly Scan
+
+    Repeat a bad fly scan, up to ``constants["FLYSCAN_MAX_RETRIES"]``
+    times, when the data integrity score of its HDF5 file
+    (``usaxs_flyscan.hdf5_file_quality``) is below
+    ``constants["FLYSCAN_MIN_QUALITY"]``.  Each fly scan writes its own file.
+    """
+    max_retries = max(constants["FLYSCAN_MAX_RETRIES"], 0)
+    for retry in range(1 + max_retries):
+        _md = dict(md or {})
+        if retry > 0:
+            _md["flyscan_retry"] = retry
+        yield from _flyscan_once(pos_X, pos_Y, thickness, scan_title, md=_md)
+        if retry == max_retries:
+            break
+
+        # check the file now (it is written in the background)
+        yield from usaxs_flyscan.wait_HDF5_file_finished()
+        quality = usaxs_flyscan.hdf5_file_quality
+        if quality is None or quality["score"] >= constants["FLYSCAN_MIN_QUALITY"]:
+            break
+        problems = ", ".join(
+            f"{k}={quality[k]}"
+            for k in flyscan_validation.CHECKS
+            if quality[k] > 0
+        )
+        msg = (
+            f"WARNING: bad Flyscan (quality score {quality['score']:.4f}: {problems}),"
+            f" repeating it ({retry+1} of {max_retries})"
+        )
+        logger.warning(msg)
+        if NOTIFY_ON_BAD_FLY_SCAN:
+            subject = "!!! bad fly scan data, repeating the fly scan !!!"
+            email_notices.send(subject, msg)
+
+
+def _flyscan_once(pos_X, pos_Y, thickness, scan_title, md=None):
+    """
+    do one USAXS Fly Scan (once, see ``Flyscan()``)
     """
     plan_name = "Flyscan"
     _md = apsbss.update_MD(md or {})
@@ -457,15 +622,7 @@ def Flyscan(pos_X, pos_Y, thickness, scan_title, md=None):
 
     yield from IfRequestedStopBeforeNextScan()
 
-    yield from mode_USAXS()
-
-    yield from bps.mv(
-        usaxs_slit.v_size, terms.SAXS.usaxs_v_size.get(),
-        usaxs_slit.h_size, terms.SAXS.usaxs_h_size.get(),
-        guard_slit.v_size, terms.SAXS.usaxs_guard_v_size.get(),
-        guard_slit.h_size, terms.SAXS.usaxs_guard_h_size.get(),
-        timeout=MASTER_TIMEOUT,
-    )
+    yield from flyscan_batch.setup()    # mode_USAXS() & slits
     yield from before_plan()
 
     yield from bps.mv(
@@ -587,6 +744,10 @@ def Flyscan(pos_X, pos_Y, thickness, scan_title, md=None):
         timeout=MASTER_TIMEOUT,
         )
 
+    if constants["FLYSCAN_BUILD_TRAJECTORIES"]:
+        # only uploaded when the parameters have changed
+        yield from flyscan_trajectories.upload()
+
     yield from user_data.set_state_plan("Running Flyscan")
 
     ### move the stages to flyscan starting values from EPICS PVs
@@ -645,32 +806,8 @@ def Flyscan(pos_X, pos_Y, thickness, scan_title, md=None):
     yield from user_data.set_state_plan("Flyscan finished")
 
     yield from bps.mvr(terms.FlyScan.order_number, 1)  # increment it
-    yield from bps.mv(
-        lax_autosave.disable, 0,    # enable
-        lax_autosave.max_time, 0,   # start right away
-
-        ti_filter_shutter, "close",
-        monochromator.feedback.on, MONO_FEEDBACK_ON,
-        # user_data.collection_in_progress, 0,
-
-        scaler0.update_rate, 5,
-        scaler0.auto_count_delay, 0.25,
-        scaler0.delay, 0.05,
-        scaler0.preset_time, 1,
-        scaler0.auto_count_time, 1,
-
-        upd_controls.auto.gainU, old_femto_change_gain_up,
-        upd_controls.auto.gainD, old_femto_change_gain_down,
-        timeout=MASTER_TIMEOUT,
-        )
-
-    yield from user_data.set_state_plan("Moving USAXS back and saving data")
-    yield from bps.mv(
-        a_stage.r, terms.USAXS.ar_val_center.get(),
-        a_stage.y, terms.USAXS.AY0.get(),
-        d_stage.y, terms.USAXS.DY0.get(),
-        timeout=MASTER_TIMEOUT,
-        )
+    yield from flyscan_batch.finish(
+        (old_femto_change_gain_up, old_femto_change_gain_down))
 
     # TODO: make this link for side-bounce
     # disable asrp link to ar for 2D USAXS
@@ -9,6 +9,7 @@ not bluesky plans (no need to execute in RE() wrapper)
 #-------------
 from .motors import *
 from .user_sample_title import *
+from .ustep_budget import *
 
 # called by other code
 # (no need to import into global namespace)
@@ -1,30 +1,170 @@
-
 """
-report how much time remains in flyscan
+report progress (such as how much time remains in flyscan)
+
+One progress service for the session (``progress_reporter``):
+one thread, sleeping until the next timer is due (no polling),
+and values from monitor subscriptions (no ``.get()`` calls
+while reporting).
 """
 
 __all__ = [
+    'progress_reporter',
     'remaining_time_reporter',
 ]
 
 from ..session_logs import logger
 logger.info(__file__)
 
-from apstools.utils import run_in_thread
+import heapq
+import itertools
+import threading
 import time
 
-@run_in_thread
-def remaining_time_reporter(title, duration_s, interval_s=5, poll_s=0.05):
+
+class ProgressReporter:
+    """
+    session progress service: timers and monitored values
+
+    Callbacks run in the one service thread.  Keep them short,
+    they delay any other timers that are due.
+
+    PUBLIC
+
+        ~call_at
+        ~call_later
+        ~call_soon
+        ~cancel
+        ~cancel_throttle
+        ~throttle
+        ~watch
+        ~unwatch
+        ~value
+    """
+
+    def __init__(self):
+        self._timers = []                   # heap of [when, seq, func, args]
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._throttled = {}                # key: pending timer (entry)
+        self._last_throttled = {}           # key: time of last call
+        self._values = {}                   # signal name: latest value
+        self._watched = {}                  # signal name: (signal, subscription id)
+        self.wakeups = 0                    # number of times the thread woke up
+
+    def call_at(self, when, func, *args):
+        """call ``func(*args)`` at time ``when`` (``time.time()``), return handle"""
+        entry = [when, next(self._seq), func, args]
+        with self._condition:
+            heapq.heappush(self._timers, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="progress_reporter", daemon=True)
+                self._thread.start()
+            if self._timers[0] is entry:
+                self._condition.notify()    # sooner than the thread is sleeping
+        return entry
+
+    def call_later(self, delay_s, func, *args):
+        """call ``func(*args)`` after ``delay_s`` seconds, return handle"""
+        return self.call_at(time.time() + delay_s, func, *args)
+
+    def call_soon(self, func, *args):
+        """call ``func(*args)`` (in the service thread) as soon as possible"""
+        return self.call_at(time.time(), func, *args)
+
+    def cancel(self, handle):
+        """cancel a timer (handle from ``call_at()``), if not yet called"""
+        if handle is not None:
+            handle[2] = None    # leave it in the heap, skip it when due
+
+    def throttle(self, key, interval_s, func, *args):
+        """
+        call ``func(*args)`` soon, no more than once per ``interval_s`` for ``key``
+
+        Calls requested while one is pending are combined,
+        the latest ``args`` are used.
+        """
+        with self._condition:
+            pending = self._throttled.get(key)
+            if pending is not None and pending[2] is not None:
+                pending[3] = (key, func, args)
+                return
+            when = max(time.time(), self._last_throttled.get(key, 0) + interval_s)
+            self._throttled[key] = self.call_at(when, self._call_throttled, key, func, args)
+
+    def cancel_throttle(self, key):
+        """cancel the pending ``throttle()`` call for ``key``, if any"""
+        with self._condition:
+            self.cancel(self._throttled.pop(key, None))
+
+    def _call_throttled(self, key, func, args):
+        with self._condition:
+            self._throttled.pop(key, None)
+            self._last_throttled[key] = time.time()
+        func(*args)
+
+    def watch(self, signal):
+        """
+        keep the latest value of ``signal`` from its monitor subscription
+
+        Watching the same signal again replaces its subscription.
+        Call ``unwatch()`` when done.
+        """
+        self.unwatch(signal)
+
+        def cb(value=None, **kwargs):
+            self._values[signal.name] = value
+
+        self._watched[signal.name] = (signal, signal.subscribe(cb))
+
+    def unwatch(self, signal):
+        """remove the subscription from ``watch()`` and forget the value"""
+        watched = self._watched.pop(signal.name, None)
+        if watched is not None:
+            watched[0].unsubscribe(watched[1])
+        self._values.pop(signal.name, None)
+
+    def value(self, signal):
+        """latest (monitored) value of ``signal``, ``.get()`` if not watched"""
+        if signal.name not in self._values:
+            return signal.get()
+        return self._values[signal.name]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if len(self._timers) == 0:
+                        self._condition.wait()
+                    else:
+                        delay = self._timers[0][0] - time.time()
+                        if delay <= 0:
+                            break
+                        self._condition.wait(delay)
+                    self.wakeups += 1
+                _when, _seq, func, args = heapq.heappop(self._timers)
+            if func is None:
+                continue    # cancelled
+            try:
+                func(*args)
+            except Exception as exc:
+                logger.error("progress_reporter: %s(): %s", func.__name__, exc)
+
+
+progress_reporter = ProgressReporter()
+
+
+def remaining_time_reporter(title, duration_s, interval_s=5):
+    """log the time remaining in ``title``, every ``interval_s``"""
     if duration_s < interval_s:
         return
-    t = time.time()
-    expires = t + duration_s
-    update = t + interval_s
-    # print()
-    while time.time() < expires:
-        remaining = expires - t
-        if t > update:
-            update += interval_s
-            logger.info(f"{title}: {remaining:.1f}s remaining")
-        time.sleep(poll_s)
-        t = time.time()
+    expires = time.time() + duration_s
+
+    def report():
+        remaining = expires - time.time()
+        if remaining > interval_s:
+            progress_reporter.call_later(interval_s, report)
+        logger.info(f"{title}: {remaining:.1f}s remaining")
+
+    progress_reporter.call_later(interval_s, report)
@@ -0,0 +1,85 @@
+"""
+choose USAXS step scan parameters for a time or ΔQ/Q budget
+"""
+
+__all__ = [
+    'chooseUstepParameters',
+    ]
+
+from ..session_logs import logger
+logger.info(__file__)
+
+from ..devices import monochromator
+from ..devices import terms
+from .a2q_q2a import q2angle
+from usaxs_support.ustep_planner import plan_uascan
+from usaxs_support.ustep_planner import points_per_decade
+from usaxs_support.ustep_planner import POINT_OVERHEAD_S
+import pyRestTable
+
+
+def chooseUstepParameters(
+        time_budget_s=None, dq_over_q=None, apply=False,
+        overhead_s=POINT_OVERHEAD_S, **kwargs):
+    """
+    choose ``num_points``, ``usaxs_minstep``, & ``uaterm`` for ``USAXSscan()``
+
+    Instead of guessing ``terms.USAXS.num_points``,
+    ``terms.USAXS.usaxs_minstep``, and ``terms.USAXS.uaterm``, give
+    the time the USAXS step scan may take or the ΔQ/Q it must reach.
+    The Q range, count time, and ``useDynamicTime`` are from ``terms.USAXS``.
+
+    Not a bluesky plan: call it from the command line.
+
+    :param float time_budget_s: longest scan (s)
+    :param float dq_over_q: largest ΔQ/Q (such as 0.05)
+    :param bool apply: write the parameters to ``terms.USAXS``
+    :param float overhead_s: time per point, besides counting (s)
+    :param kwargs: passed to ``usaxs_support.ustep_planner.plan_uascan()``
+    :return: dict from ``plan_uascan()``
+
+    EXAMPLE::
+
+        chooseUstepParameters(time_budget_s=300)
+        chooseUstepParameters(dq_over_q=0.04, apply=True)
+    """
+    center = terms.USAXS.ar_val_center.get()
+    wavelength = monochromator.dcm.wavelength.get()
+    plan = plan_uascan(
+        center - q2angle(terms.USAXS.start_offset.get(), wavelength),
+        center,
+        center - q2angle(terms.USAXS.finish.get(), wavelength),
+        wavelength,
+        terms.USAXS.usaxs_time.get(),
+        time_budget_s=time_budget_s,
+        dq_over_q=dq_over_q,
+        dynamic=bool(terms.USAXS.useDynamicTime.get()),
+        overhead_s=overhead_s,
+        **kwargs)
+
+    table = pyRestTable.Table()
+    table.labels = "term now planned".split()
+    table.addRow(("num_points", terms.USAXS.num_points.get(), plan["numPts"]))
+    table.addRow(("usaxs_minstep", terms.USAXS.usaxs_minstep.get(), f"{plan['minStep']:.3g}"))
+    table.addRow(("uaterm", terms.USAXS.uaterm.get(), f"{plan['exponent']:.3g}"))
+    print(table)
+    print(f"predicted: {plan['duration_s']:.0f} s, worst ΔQ/Q: {plan['dq_over_q']:.3g}")
+    if not plan["within_budget"]:
+        logger.warning(
+            "ΔQ/Q=%g needs %.0f s, more than %g s",
+            dq_over_q, plan["duration_s"], time_budget_s)
+
+    table = pyRestTable.Table()
+    table.labels = "Q decade (1/A) points".split()
+    for decade, n in points_per_decade(plan["q"]).items():
+        table.addRow((f"{decade:g}", n))
+    print(table)
+
+    if apply:
+        terms.USAXS.num_points.put(plan["numPts"])
+        terms.USAXS.usaxs_minstep.put(plan["minStep"])
+        terms.USAXS.uaterm.put(plan["exponent"])
+        logger.info(
+            "USAXS step scan: num_points=%d, usaxs_minstep=%g, uaterm=%g",
+            plan["numPts"], plan["minStep"], plan["exponent"])
+    return plan
@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+
+"""
+timing benchmarks for the USAXS fly scan support code
+
+Most benchmarks need EPICS PVs.  Away from the instrument,
+start the simulated IOC first (in another shell)::
+
+    python ./sim_flyscan_ioc.py
+
+then run a benchmark::
+
+    python ./benchmark_saveFlyData.py pv_read
+"""
+
+import logging
+import numpy
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import hdf5_writer      # when run standalone
+    import nexus
+    import saveFlyData
+except ImportError:
+    from . import hdf5_writer   # when imported in a package
+    from . import nexus
+    from . import saveFlyData
+
+
+logger = logging.getLogger(os.path.split(__file__)[-1])
+
+XML_CONFIGURATION_FILE = saveFlyData.XML_CONFIGURATION_FILE
+
+
+def _report(title, results):
+    """print a table of (label, seconds) results"""
+    print(title)
+    width = max(len(label) for label, _ in results)
+    for label, seconds in results:
+        print(f"  {label:{width}}  {seconds*1000:10.3f} ms")
+
+
+def bench_pv_read(config_file=XML_CONFIGURATION_FILE, repeat=5):
+    """
+    compare serial and batched reads of the preliminary PVs
+
+    The serial read is the method used before ``_read_pv_values()``.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sfs = saveFlyData.SaveFlyScan(os.path.join(tmpdir, "bench.h5"), config_file)
+        pv_specs = [
+            pv_spec
+            for pv_spec in sfs.mgr.pv_registry.values()
+            if not pv_spec.acquire_after_scan and pv_spec.ophyd_signal.connected
+        ]
+
+        t_serial = []
+        t_batched = []
+        for _i in range(repeat):
+            t0 = time.time()
+            for pv_spec in pv_specs:
+                pv_spec.ophyd_signal.get(
+                    as_string=pv_spec.as_string, timeout=10, use_monitor=False)
+            t_serial.append(time.time() - t0)
+
+            t0 = time.time()
+            sfs._read_pv_values(pv_specs, "bench_pv_read")
+            t_batched.append(time.time() - t0)
+
+        sfs.preliminaryWriteFile()
+        sfs.saveFile()
+
+    latency = sorted(sfs.pv_read_latency.values())
+    _report(
+        f"read {len(pv_specs)} PVs (best of {repeat})",
+        [
+            ("serial", min(t_serial)),
+            ("batched", min(t_batched)),
+            ("median PV latency", latency[len(latency)//2]),
+            ("slowest PV latency", latency[-1]),
+        ]
+    )
+
+
+def bench_count_limited(config_file=XML_CONFIGURATION_FILE, scans=(100, 8000, None), repeat=5):
+    """
+    compare full and count-limited reads of the length-limited arrays
+
+    For each scan length, the ``length_limit`` PVs (such as the Struck
+    current channel) are set to that many channels (``None``: the
+    full array), then the length-limited arrays are read with and
+    without ``SaveFlyScan.count_limited_reads``.  Reports the read
+    time and the peak memory traced while reading.
+
+    Start the simulated IOC with long arrays, such as::
+
+        python ./sim_flyscan_ioc.py --array-length 320000
+    """
+    import epics
+    import tracemalloc
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sfs = saveFlyData.SaveFlyScan(os.path.join(tmpdir, "bench.h5"), config_file)
+        pv_reg = sfs.mgr.pv_registry
+        limited = [p for p in pv_reg.values() if p.length_limit in pv_reg]
+        limits = sorted(set(pv_reg[p.length_limit].pvname for p in limited))
+        full_length = max(p.ophyd_signal._read_pv.count for p in limited)
+
+        print(f"read {len(limited)} arrays of up to {full_length} (best of {repeat})")
+        print(f"  {'channels':>8}  {'read':16}  {'peak MB':>8}  {'read ms':>10}")
+        for channels in scans:
+            channels = channels or full_length
+            for pvname in limits:
+                epics.caput(pvname, channels, wait=True)
+            for label, count_limited in (("full arrays", False), ("count-limited", True)):
+                sfs.count_limited_reads = count_limited
+                t_read = []
+                for _i in range(repeat):
+                    t0 = time.time()
+                    sfs._read_pv_values(limited, "bench_count_limited")
+                    t_read.append(time.time() - t0)
+                tracemalloc.start()
+                sfs._read_pv_values(limited, "bench_count_limited")
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"  {channels:8d}  {label:16}  {peak/1e6:8.3f}  {min(t_read)*1000:10.3f}")
+        sfs.preliminaryWriteFile()
+        sfs.saveFile()
+
+
+def bench_manager(config_file=XML_CONFIGURATION_FILE, repeat=5):
+    """
+    compare SaveFlyScan setup with and without the session signal pool
+
+    Without the pool (the method used before), each new manager
+    parses the XML file and connects all the PVs again.
+    """
+    def _setup(tmpdir, i):
+        t0 = time.time()
+        sfs = saveFlyData.SaveFlyScan(os.path.join(tmpdir, f"bench_{i}.h5"), config_file)
+        elapsed = time.time() - t0
+        sfs.mgr.group_registry['/'].hdf5_group.close()
+        return elapsed
+
+    t_reconnect = []
+    t_pooled = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i in range(repeat):
+            nexus.reset_manager()
+            for pool in (nexus.signal_pool, nexus.desc_pool):
+                for pvname in list(pool.keys()):
+                    pool.pop(pvname).destroy()
+            nexus.signal_metadata.clear()
+            t_reconnect.append(_setup(tmpdir, 2*i))
+            t_pooled.append(_setup(tmpdir, 2*i+1))
+
+    _report(
+        f"SaveFlyScan() setup (best of {repeat})",
+        [
+            ("parse & connect", min(t_reconnect)),
+            ("session pool", min(t_pooled)),
+        ]
+    )
+
+
+def bench_config(config_file=XML_CONFIGURATION_FILE, repeat=5):
+    """
+    compare reading the configuration cold (parse) and warm (compiled cache)
+
+    Does not need EPICS.
+    """
+    t_cold = []
+    t_warm = []
+    cache_dir = nexus.CONFIG_CACHE_DIR
+    with tempfile.TemporaryDirectory() as tmpdir:
+        nexus.CONFIG_CACHE_DIR = tmpdir
+        try:
+            for i in range(repeat):
+                for fname in os.listdir(tmpdir):
+                    os.remove(os.path.join(tmpdir, fname))
+                for results in (t_cold, t_warm):
+                    t0 = time.time()
+                    nexus.NeXus_Structure(config_file)._read_configuration()
+                    results.append(time.time() - t0)
+        finally:
+            nexus.CONFIG_CACHE_DIR = cache_dir
+
+    _report(
+        f"read configuration (best of {repeat})",
+        [
+            ("cold (validate & parse)", min(t_cold)),
+            ("warm (compiled cache)", min(t_warm)),
+        ]
+    )
+
+
+def synthetic_config(config_file, num_pvs, pvs_per_group=10):
+    """
+    write a synthetic XML configuration file with ``num_pvs`` PVs
+
+    Each group holds ``pvs_per_group`` PVs, a field, and a link.
+    """
+    groups = []
+    for g in range((num_pvs + pvs_per_group - 1) // pvs_per_group):
+        items = [
+            f'<PV label="pv_{i}" pvname="sim:g{g}:pv{i}" />'
+            for i in range(pvs_per_group)
+            if g*pvs_per_group + i < num_pvs
+        ]
+        items.append(f'<field name="note"><text>group {g}</text></field>')
+        items.append(f'<link name="first" source="/entry/g{g}/pv_0" />')
+        groups.append(
+            f'<group name="g{g}" class="NXnote">'
+            + "".join(items)
+            + '</group>'
+        )
+    with open(config_file, "w") as fp:
+        fp.write(
+            '<saveFlyData version="1.2">'
+            '<triggerPV pvname="sim:start" start_value="1" start_text="Busy"'
+            ' done_value="0" done_text="Done" />'
+            '<timeoutPV pvname="sim:timeout" units="s" />'
+            '<NX_structure><group name="/" class="file">'
+            '<group name="entry" class="NXentry">'
+            + "".join(groups)
+            + '</group></group></NX_structure></saveFlyData>'
+        )
+
+
+def bench_scaling(config_file=None, sizes=(100, 1000, 10000)):
+    """
+    time parsing of synthetic configurations, should scale linearly
+
+    Does not need EPICS.  (``config_file`` is not used.)
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for num_pvs in sizes:
+            fname = os.path.join(tmpdir, f"config_{num_pvs}.xml")
+            synthetic_config(fname, num_pvs)
+            mgr = nexus.NeXus_Structure(fname)
+            t0 = time.time()
+            mgr._parse_configuration()
+            elapsed = time.time() - t0
+            assert len(mgr.pv_registry) == num_pvs
+            results.append((f"{num_pvs} PVs", elapsed))
+            results.append((f"{num_pvs} PVs, per PV", elapsed / num_pvs))
+
+    _report("parse synthetic configurations", results)
+
+
+def bench_writer(config_file=None, num_arrays=3, num_channels=4_000_000, num_messages=2000):
+    """
+    RunEngine message latency while a large HDF5 file is written
+
+    Compares writing in this process (with h5py) and in the
+    HDF5 writer process.  Does not need EPICS.
+    (``config_file`` is not used.)
+    """
+    from bluesky import RunEngine
+    from bluesky import plan_stubs as bps
+
+    RE = RunEngine({})
+    RE.msg_hook = None
+    data = numpy.random.poisson(1000, num_channels).astype(numpy.uint32)
+
+    def _write(h5open, fname, done):
+        f = h5open(fname, "w")
+        for i in range(num_arrays):
+            f.create_dataset(f"mca{i+1}", data=data, compression="gzip")
+        f.close()
+        done.set()
+
+    def _latency(h5open, fname):
+        """median and longest time per RunEngine message"""
+        times = []
+        done = threading.Event()
+
+        def plan():
+            if h5open is not None:
+                threading.Thread(target=_write, args=(h5open, fname, done)).start()
+            for _i in range(num_messages):
+                t0 = time.perf_counter()
+                yield from bps.null()
+                times.append(time.perf_counter() - t0)
+                if done.is_set():
+                    break
+
+        RE(plan())
+        if h5open is not None:
+            done.wait()
+        times = sorted(times)
+        return times[len(times)//2], times[-1], len(times)
+
+    import h5py
+    writer = hdf5_writer.HDF5WriterService()
+    writer.start()
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, "bench.h5")
+        for label, h5open in (
+            ("idle", None),
+            ("h5py in process", h5py.File),
+            ("writer process", writer.File),
+        ):
+            median, longest, n = _latency(h5open, fname)
+            results.append((f"{label}: median ({n} msgs)", median))
+            results.append((f"{label}: longest", longest))
+    writer.stop()
+
+    _report(
+        f"RunEngine message time, writing {num_arrays} x {num_channels} uint32 (gzip)",
+        results
+    )
+
+
+def bench_compression(config_file=None, sizes=(8000, 32000, 100000), repeat=3):
+    """
+    file size, write and read time of MCA-like arrays with each storage policy
+
+    The arrays are Poisson counts (uint32), as recorded by the
+    Struck scaler.  Does not need EPICS.
+    (``config_file`` is not used.)
+    """
+    import h5py
+
+    policies = (
+        ("none", {}),
+        ("gzip 1", dict(compression="gzip", compression_opts=1)),
+        ("gzip 4", dict(compression="gzip", compression_opts=4)),
+        ("gzip 9", dict(compression="gzip", compression_opts=9)),
+        ("gzip 4 + shuffle", dict(compression="gzip", compression_opts=4, shuffle=True)),
+        ("lzf", dict(compression="lzf")),
+        ("lzf + shuffle", dict(compression="lzf", shuffle=True)),
+    )
+    rng = numpy.random.default_rng(1)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, "bench.h5")
+        for num_channels in sizes:
+            # three arrays: like the upd, I0, and I00 MCA channels
+            arrays = [
+                rng.poisson(lam, num_channels).astype(numpy.uint32)
+                for lam in (20, 1000, 50000)
+            ]
+            print(f"{len(arrays)} x {num_channels} uint32 (best of {repeat})")
+            print(f"  {'storage':16}  {'bytes':>10}  {'write ms':>10}  {'read ms':>10}")
+            for label, storage in policies:
+                t_write = []
+                t_read = []
+                for _i in range(repeat):
+                    t0 = time.time()
+                    with h5py.File(fname, "w") as f:
+                        for i, data in enumerate(arrays):
+                            saveFlyData.makeDataset(f, f"mca{i+1}", data, storage=storage)
+                    t_write.append(time.time() - t0)
+
+                    t0 = time.time()
+                    with h5py.File(fname, "r") as f:
+                        for i in range(len(arrays)):
+                            f[f"mca{i+1}"][()]
+                    t_read.append(time.time() - t0)
+                size = os.path.getsize(fname)
+                print(
+                    f"  {label:16}  {size:10d}"
+                    f"  {min(t_write)*1000:10.3f}  {min(t_read)*1000:10.3f}"
+                )
+
+
+def bench_mca_write(config_file=None, sizes=(8000, 80000, 320000), num_scalars=300, repeat=3):
+    """
+    time and peak memory to write a synthetic MCA fly scan to a file
+
+    Each file holds ``num_scalars`` scalar PVs (written with
+    ``saveFlyData.scalar_array()``) and three MCA arrays: native
+    int32 from CA (as-is, a length-limited view) and, for comparison,
+    the same data as Python lists.  Peak memory is the largest
+    allocation traced (``tracemalloc``) while writing.
+    Does not need EPICS.  (``config_file`` is not used.)
+    """
+    import h5py
+    import tracemalloc
+
+    scalars = [
+        (f"pv_{i}", [1.5 * i, i, f"text {i}"][i % 3])
+        for i in range(num_scalars)
+    ]
+    rng = numpy.random.default_rng(1)
+
+    def _write(fname, arrays):
+        with h5py.File(fname, "w") as f:
+            for name, value in scalars:
+                saveFlyData.makeDataset(f, name, saveFlyData.scalar_array(value))
+            for i, data in enumerate(arrays):
+                saveFlyData.makeDataset(f, f"mca{i+1}", data)
+
+    print(f"{num_scalars} scalars and 3 MCA arrays (best of {repeat})")
+    print(f"  {'array':16}  {'channels':>8}  {'data MB':>8}  {'peak MB':>8}  {'write ms':>10}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, "bench.h5")
+        for num_channels in sizes:
+            # CA buffer: EPICS_CA_MAX_ARRAY_BYTES of int32, NORD channels used
+            buffers = [
+                rng.poisson(lam, 320000).astype(numpy.int32)
+                for lam in (20, 1000, 50000)
+            ]
+            for label, arrays in (
+                    ("native (view)", [b[:num_channels] for b in buffers]),
+                    ("python list", [b[:num_channels].tolist() for b in buffers]),
+                    ):
+                t_write = []
+                for _i in range(repeat):
+                    t0 = time.time()
+                    _write(fname, arrays)
+                    t_write.append(time.time() - t0)
+                tracemalloc.start()     # slows the writing, separate run
+                _write(fname, arrays)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                data_bytes = sum(b[:num_channels].nbytes for b in buffers)
+                print(
+                    f"  {label:16}  {num_channels:8d}  {data_bytes/1e6:8.3f}"
+                    f"  {peak/1e6:8.3f}  {min(t_write)*1000:10.3f}"
+                )
+
+
+BENCHMARKS = dict(
+    compression=bench_compression,
+    config=bench_config,
+    count_limited=bench_count_limited,
+    manager=bench_manager,
+    mca_write=bench_mca_write,
+    pv_read=bench_pv_read,
+    scaling=bench_scaling,
+    writer=bench_writer,
+)
+
+
+def get_CLI_options():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+
+    parser.add_argument('benchmark',
+                    action='store',
+                    choices=sorted(BENCHMARKS),
+                    help="benchmark to run")
+
+    parser.add_argument('--config',
+                    action='store',
+                    default=XML_CONFIGURATION_FILE,
+                    help="XML configuration file")
+
+    return parser.parse_args()
+
+
+def main():
+    cli_options = get_CLI_options()
+    # the support modules log at DEBUG level, that would be timed too
+    for module in (hdf5_writer, nexus, saveFlyData):
+        module.logger.setLevel(logging.INFO)
+    BENCHMARKS[cli_options.benchmark](config_file=cli_options.config)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""
+check that all PVs of a saveFlyData.xml configuration are available
+
+The configuration file is read (and validated) by ``nexus.NeXus_Structure``.
+All PVs are connected at the same time, so the check takes (at most)
+about one connection timeout, no matter how many PVs are missing.
+
+For each PV, reports:
+
+* time to connect (or not connected)
+* EPICS data type
+* element count
+* ``.DESC`` availability (not for PVs that name a field)
+
+USAGE::
+
+    python ./check_saveFlyData.py
+    python ./check_saveFlyData.py --missing /path/to/saveFlyData.xml
+
+Away from the instrument, check against the simulated IOC::
+
+    python ./sim_flyscan_ioc.py &
+    python ./check_saveFlyData.py
+
+The exit status is the number of PVs that did not connect (max: 255).
+"""
+
+import epics
+import logging
+import os
+import pyRestTable
+import sys
+import threading
+import time
+
+try:
+    import nexus        # when run standalone
+except ImportError:
+    from . import nexus # when imported in a package
+
+
+logger = logging.getLogger(os.path.split(__file__)[-1])
+
+path = os.path.dirname(__file__)
+XML_CONFIGURATION_FILE = os.path.join(path, 'saveFlyData.xml')
+CONNECTION_TIMEOUT_s = 5.0
+NOT_CONNECTED_TEXT = "not connected"
+
+
+class PV_Audit(object):
+    """connection report for one PV (and its .DESC field)"""
+
+    def __init__(self, pvname, labels=()):
+        self.pvname = pvname
+        self.labels = list(labels)
+        self.connect_time = None
+        self.desc_connect_time = None
+        self._t0 = time.time()
+        self._connected = threading.Event()
+        self._desc_connected = threading.Event()
+        self.pv = epics.PV(
+            pvname, form="native", auto_monitor=False,
+            connection_callback=self._connection_cb)
+        if pvname.find(".") < 0:
+            self.desc_pv = epics.PV(
+                pvname + ".DESC", auto_monitor=False,
+                connection_callback=self._desc_connection_cb)
+        else:
+            # includes a field as part of pvname
+            # cannot attach .DESC as suffix to this
+            self.desc_pv = None
+
+    def _connection_cb(self, pvname=None, conn=None, **kwargs):
+        if conn and self.connect_time is None:
+            self.connect_time = time.time() - self._t0
+            self._connected.set()
+
+    def _desc_connection_cb(self, pvname=None, conn=None, **kwargs):
+        if conn and self.desc_connect_time is None:
+            self.desc_connect_time = time.time() - self._t0
+            self._desc_connected.set()
+
+    @property
+    def connected(self):
+        return self.connect_time is not None
+
+    def wait(self, deadline):
+        """wait for connection until ``deadline`` (from ``time.time()``)"""
+        if self._connected.wait(max(deadline - time.time(), 0)) and self.desc_pv is not None:
+            # .DESC connects with its record, no need to wait if the record is missing
+            self._desc_connected.wait(max(deadline - time.time(), 0))
+        return self.connected
+
+    @property
+    def desc(self):
+        if self.desc_pv is None:
+            return "-"
+        if self.desc_connect_time is None:
+            return "no"
+        return "yes"
+
+    def row(self):
+        """one row of the report table"""
+        if self.connected:
+            connect = f"{self.connect_time*1000:.1f}"
+            type_ = self.pv.type
+            count = self.pv.count
+        else:
+            connect = NOT_CONNECTED_TEXT
+            type_ = ""
+            count = ""
+        return (self.pvname, connect, type_, count, self.desc, ", ".join(self.labels))
+
+
+def audit_configuration(config_file=XML_CONFIGURATION_FILE, timeout=CONNECTION_TIMEOUT_s):
+    """
+    connect (concurrently) to all PVs in the XML configuration file
+
+    :param str config_file: saveFlyData.xml configuration file
+    :param float timeout: longest time (s) to wait for all PVs to connect
+    :return: (list of PV_Audit, wall time in seconds)
+    """
+    t0 = time.time()
+    mgr = nexus.NeXus_Structure(config_file)
+    mgr._read_configuration()
+
+    labels = {
+        mgr.trigger_pv: ["triggerPV"],
+        mgr.timeout_pv: ["timeoutPV"],
+    }
+    for pv_spec in mgr.pv_registry.values():
+        labels.setdefault(pv_spec.pvname, []).append(pv_spec.label)
+
+    # create all channels first, then wait (once) for all of them
+    audits = [PV_Audit(pvname, item) for pvname, item in labels.items()]
+    epics.ca.flush_io()
+    deadline = time.time() + timeout
+    for audit in audits:
+        audit.wait(deadline)
+    return audits, time.time() - t0
+
+
+def report(audits, wall_time, missing_only=False):
+    """return the audit as a table (str)"""
+    table = pyRestTable.Table()
+    table.labels = "PV connect_ms type count DESC label(s)".split()
+    for audit in sorted(audits, key=lambda a: a.pvname):
+        if missing_only and audit.connected:
+            continue
+        table.addRow(audit.row())
+
+    num_missing = len([a for a in audits if not a.connected])
+    summary = (
+        f"{len(audits)} PVs, {len(audits)-num_missing} connected,"
+        f" {num_missing} not connected, wall time {wall_time:.3f} s"
+    )
+    return str(table) + "\n" + summary
+
+
+def get_CLI_options():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+
+    parser.add_argument('xml_config_file',
+                    action='store',
+                    nargs='?',
+                    default=XML_CONFIGURATION_FILE,
+                    help="XML configuration file")
+
+    parser.add_argument('--timeout',
+                    action='store',
+                    type=float,
+                    default=CONNECTION_TIMEOUT_s,
+                    help="connection timeout (s) for all PVs")
+
+    parser.add_argument('--missing',
+                    action='store_true',
+                    help="only list the PVs that did not connect")
+
+    return parser.parse_args()
+
+
+def main():
+    cli_options = get_CLI_options()
+    audits, wall_time = audit_configuration(
+        cli_options.xml_config_file, cli_options.timeout)
+    print(report(audits, wall_time, missing_only=cli_options.missing))
+    sys.exit(min(len([a for a in audits if not a.connected]), 255))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""
+databroker handler: arrays in the USAXS fly scan HDF5 file
+
+The fly scan arrays (such as ``mca1``) are written once, to the
+fly scan HDF5 file (by ``saveFlyData.SaveFlyScan``).  The bluesky
+documents only reference them:
+
+* one ``resource`` document per fly scan file:
+  ``spec=FLYSCAN_HDF5_SPEC``, ``root`` + ``resource_path`` is the file
+* one ``datum`` document per array:
+  ``datum_kwargs={"address": "/entry/flyScan/mca1"}``
+
+Register this handler with databroker to load the arrays (lazily)::
+
+    from usaxs_support.flyscan_handler import FLYSCAN_HDF5_SPEC, FlyScanHDF5Handler
+    db.reg.register_handler(FLYSCAN_HDF5_SPEC, FlyScanHDF5Handler, overwrite=True)
+
+PUBLIC
+
+    ~FlyScanHDF5Handler
+"""
+
+import logging
+import os
+
+# do not warn if the HDF5 library version has changed
+os.environ['HDF5_DISABLE_VERSION_CHECK'] = '2'
+import h5py
+
+
+logger = logging.getLogger(os.path.split(__file__)[-1])
+
+FLYSCAN_HDF5_SPEC = "USAXS_FLYSCAN_HDF5"
+
+
+class FlyScanHDF5Handler(object):
+    """
+    read one array (by HDF5 address) from a fly scan HDF5 file
+
+    :param str filename: fly scan HDF5 file (from the resource document)
+
+    The file is opened (read-only) for each array and closed again:
+    an open handle would keep others (such as ``NXWriterFlyScan``)
+    from opening the file to write.
+    """
+
+    specs = {FLYSCAN_HDF5_SPEC}
+
+    def __init__(self, filename, **resource_kwargs):
+        self._filename = filename
+
+    def __call__(self, address):
+        """return the array at HDF5 ``address`` (from the datum document)"""
+        with h5py.File(self._filename, "r") as f:
+            return f[address][()]
+
+    def get_file_list(self, datum_kwargs_gen):
+        return [self._filename]
+
+    def close(self):
+        pass    # no file is kept open
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+"""
+session master (index) file of USAXS fly scan files
+
+After each fly scan file is saved, it is added to the master file:
+
+* an external link to the ``/entry`` of the fly scan file
+* one row in each virtual dataset, stacking the arrays
+  (such as ``mca1``) of all the fly scans
+* one row of metadata: file name, title, order number,
+  time, sample temperature, number of channels of each array
+
+Read a whole series at once, reading only the slices needed::
+
+    import h5py
+    with h5py.File("flyscan_master.h5", "r") as master:
+        data = master["/entry/data"]
+        mca1 = data["mca1"][:, :2000]     # every scan, first 2000 channels
+        T = data["temperature"][()]
+
+The virtual datasets are as long as the longest array; shorter
+arrays are padded with the fill value (``-1``, for integer arrays,
+``NaN`` for floating point).  The number of channels of each array
+in each scan is in ``/entry/data/<array>_channels``.
+
+Each time a scan is added, a new master file replaces the old one.
+The virtual datasets map blocks of scans (``/entry/blocks``),
+only the last block is new, full blocks are copied as they are.
+
+Only references (links, virtual dataset mappings) are written to
+the master file, the data stays in the fly scan files (in the same
+directory, or below).  Fly scan files are named by their path relative
+to the master file, so the directory may be moved as a whole.
+
+USAGE::
+
+    python ./flyscan_master.py master.h5 scan_0001.h5 scan_0002.h5 ...
+
+PUBLIC
+
+    ~FlyScanMasterFile
+"""
+
+import datetime
+import logging
+import numpy
+import os
+import re
+
+# do not warn if the HDF5 library version has changed
+os.environ['HDF5_DISABLE_VERSION_CHECK'] = '2'
+import h5py
+
+
+logger = logging.getLogger(os.path.split(__file__)[-1])
+
+FLYSCAN_MASTER_FILE = "flyscan_master.h5"
+DEFAULT_ARRAYS = (
+    "/entry/flyScan/mca1",
+    "/entry/flyScan/mca2",
+    "/entry/flyScan/mca3",
+    "/entry/flyScan/AR_PulsePositions",
+)
+TITLE_PATH = "/entry/title"
+TEMPERATURE_PATH = "/entry/sample/temperature"
+ORDER_NUMBER_PATTERN = re.compile(r"_(\d+)\.h5$")     # Flyscan(): <title>_<order>.h5
+NUMERIC_KINDS = "iuf"   # dtype kinds of the arrays in virtual datasets
+BLOCK_SIZE = 32    # scans in each block of a virtual dataset
+METADATA = {    # one row per scan in /entry/data, name: dtype
+    "file_name": h5py.string_dtype(),
+    "title": h5py.string_dtype(),
+    "order_number": numpy.int64,
+    "time": h5py.string_dtype(),
+    "temperature": numpy.float64,
+}
+
+
+class FlyScanMasterFile(object):
+    """
+    add fly scan files to a session master file
+
+    :param str master_file: name of the master HDF5 file
+        (created when the first fly scan file is added)
+    :param [str] arrays: HDF5 paths (in the fly scan files)
+        of the arrays to stack as virtual datasets
+    """
+
+    def __init__(self, master_file, arrays=DEFAULT_ARRAYS):
+        self.master_file = os.path.abspath(master_file)
+        self.arrays = tuple(arrays)
+
+    def add_scan(self, hdf5_file, title=None, order_number=None, time=None, temperature=None):
+        """
+        add one (closed) fly scan file to the master file
+
+        Metadata not given is read from the fly scan file
+        (or, for the order number, from its name).
+
+        :param str hdf5_file: name of the fly scan file
+        :param str title: sample title
+        :param int order_number: fly scan order number
+        :param str time: ISO8601 time the fly scan file was saved
+        :param float temperature: sample temperature
+        :return: number of scans in the master file
+        """
+        hdf5_file = os.path.abspath(hdf5_file)
+        master_dir = os.path.dirname(self.master_file)
+        source = os.path.relpath(hdf5_file, master_dir)
+
+        shapes = {}
+        with h5py.File(hdf5_file, "r") as scan:
+            for path in self.arrays:
+                obj = scan.get(path)
+                if not isinstance(obj, h5py.Dataset):
+                    continue
+                if obj.ndim == 1 and obj.dtype.kind in NUMERIC_KINDS:
+                    shapes[path] = obj.shape[0], obj.dtype
+                else:
+                    # such as "not connected" or "no data", from saveFlyData
+                    logger.warning(
+                        "%s: %s is not a numeric array (%s, shape %s), 0 channels",
+                        hdf5_file, path, obj.dtype, obj.shape)
+            if title is None:
+                title = _read_text(scan, TITLE_PATH)
+            if temperature is None:
+                temperature = _read_number(scan, TEMPERATURE_PATH)
+            if time is None:
+                time = _decode(scan.attrs.get("timestamp", ""))
+        if order_number is None:
+            match = ORDER_NUMBER_PATTERN.search(hdf5_file)
+            order_number = -1 if match is None else int(match.group(1))
+
+        rows, dtypes = self._read_rows()
+        row = dict(
+            file_name=source,
+            title=title or "",
+            order_number=order_number,
+            time=time or datetime.datetime.now().isoformat(sep=" "),
+            temperature=numpy.nan if temperature is None else temperature,
+        )
+        for path in self.arrays:
+            label = _label(path)
+            channels, dtype = shapes.get(path, (0, None))
+            if dtype is not None:
+                recorded = dtypes.setdefault(label, dtype.str)
+                if recorded != dtype.str:
+                    logger.warning(
+                        "%s: %s dtype %s is not %s (as the other scans), 0 channels",
+                        hdf5_file, path, dtype.str, recorded)
+                    channels = 0
+            row[f"{label}_channels"] = channels
+        for key, value in row.items():
+            rows[key].append(value)
+
+        # A virtual dataset cannot grow (it is only a mapping) and space
+        # of deleted objects is not reclaimed: write a new master file
+        # and replace the old one (readers keep the old one, if open).
+        n = len(rows["file_name"])
+        temporary = f"{self.master_file}.{os.getpid()}.tmp"
+        try:
+            with h5py.File(temporary, "w") as master:
+                if os.path.exists(self.master_file):
+                    with h5py.File(self.master_file, "r") as previous:
+                        self._write(master, rows, dtypes, previous)
+                else:
+                    self._write(master, rows, dtypes)
+            os.replace(temporary, self.master_file)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        logger.debug("%s: added %s as scan_%04d", self.master_file, source, n)
+        return n
+
+    def _read_rows(self):
+        """metadata rows (dict of lists) & array dtypes (dict) from the master file"""
+        rows = {key: [] for key in METADATA}
+        rows.update({f"{_label(path)}_channels": [] for path in self.arrays})
+        dtypes = {}
+        if not os.path.exists(self.master_file):
+            return rows, dtypes
+
+        with h5py.File(self.master_file, "r") as master:
+            data = master["entry/data"]
+            for key in rows:
+                if key not in data:
+                    continue
+                ds = data[key]
+                if ds.dtype.kind == "O":
+                    ds = ds.asstr()
+                rows[key] = list(ds[()])
+            for path in self.arrays:
+                label = _label(path)
+                if f"{label}_dtype" in data.attrs:
+                    dtypes[label] = _decode(data.attrs[f"{label}_dtype"])
+        for label, dtype in list(dtypes.items()):
+            if numpy.dtype(dtype).kind not in NUMERIC_KINDS:
+                # recorded by an older version, cannot be read
+                logger.warning("%s: dropping %s arrays of dtype %s", self.master_file, label, dtype)
+                del dtypes[label]
+                rows[f"{label}_channels"] = [0] * len(rows[f"{label}_channels"])
+        n = len(rows["file_name"])
+        for key, values in rows.items():
+            values.extend([0] * (n - len(values)))     # array added since
+        return rows, dtypes
+
+    def _write(self, master, rows, dtypes, previous=None):
+        """
+        write the master file: links, metadata, virtual datasets
+
+        Links and full blocks are copied (by HDF5) from the
+        ``previous`` master file, only the last block is new.
+        """
+        master.attrs["creator"] = __file__
+        master.attrs["default"] = "entry"
+        entry = master.create_group("entry")
+        entry.attrs["NX_class"] = "NXentry"
+        entry.attrs["default"] = "data"
+        if previous is not None and "entry/scans" in previous:
+            previous.copy(previous["entry/scans"], entry, "scans")
+            scans = entry["scans"]
+        else:
+            scans = entry.create_group("scans")
+            scans.attrs["NX_class"] = "NXcollection"
+        blocks = entry.create_group("blocks")
+        blocks.attrs["NX_class"] = "NXcollection"
+        data = entry.create_group("data")
+        data.attrs["NX_class"] = "NXdata"
+        data.attrs["signal"] = _label(self.arrays[0]) if len(self.arrays) else "temperature"
+
+        for i in range(len(scans), len(rows["file_name"])):
+            scans[f"scan_{i+1:04d}"] = h5py.ExternalLink(rows["file_name"][i], "/entry")
+        for key, values in rows.items():
+            dtype = METADATA.get(key, numpy.int64)
+            data.create_dataset(key, data=numpy.array(values, dtype=dtype))
+        for label, dtype in dtypes.items():
+            data.attrs[f"{label}_dtype"] = dtype
+        for path in self.arrays:
+            self._make_virtual_dataset(data, blocks, path, rows, previous)
+
+    def _make_virtual_dataset(self, data, blocks, path, rows, previous=None):
+        """
+        create the virtual dataset that stacks array ``path`` of all scans
+
+        It maps the virtual datasets of blocks of ``BLOCK_SIZE`` scans
+        (in ``/entry/blocks``).  A full block does not change:
+        it is copied from the ``previous`` master file.
+        """
+        label = _label(path)
+        channels = rows[f"{label}_channels"]
+        dtype = numpy.dtype(data.attrs.get(f"{label}_dtype", "<f8"))
+        fillvalue = numpy.nan if dtype.kind == "f" else -1
+
+        copy_full_blocks = (
+            previous is not None
+            and "entry/blocks" in previous      # not in older master files
+            and _decode(previous["entry/data"].attrs.get(f"{label}_dtype", "")) == dtype.str)
+
+        width = max(max(channels, default=0), 1)
+        layout = h5py.VirtualLayout(shape=(len(channels), width), dtype=dtype)
+        for lo in range(0, len(channels), BLOCK_SIZE):
+            hi = min(lo + BLOCK_SIZE, len(channels))
+            name = f"{label}_{lo // BLOCK_SIZE + 1:04d}"
+            shape = (hi - lo, max(max(channels[lo:hi]), 1))
+            if copy_full_blocks and hi < len(channels):
+                # full in the previous master file too
+                previous.copy(f"entry/blocks/{name}", blocks, name)
+            else:
+                block = h5py.VirtualLayout(shape=shape, dtype=dtype)
+                for i in range(lo, hi):
+                    n = int(channels[i])
+                    if n > 0:
+                        block[i - lo, :n] = h5py.VirtualSource(
+                            rows["file_name"][i], path, shape=(n,), dtype=dtype)
+                blocks.create_virtual_dataset(name, block, fillvalue=fillvalue)
+            layout[lo:hi, :shape[1]] = h5py.VirtualSource(
+                ".", f"{blocks.name}/{name}", shape=shape, dtype=dtype)
+        data.create_virtual_dataset(label, layout, fillvalue=fillvalue)
+
+
+def _label(path):
+    return path.rstrip("/").split("/")[-1]
+
+
+def _decode(value):
+    if isinstance(value, numpy.ndarray):
+        value = value.flat[0] if value.size else ""
+    if isinstance(value, bytes):
+        value = value.decode("utf8", errors="replace")
+    return str(value)
+
+
+def _read_text(scan, path):
+    if path not in scan:
+        return None
+    return _decode(scan[path][()])
+
+
+def _read_number(scan, path):
+    if path not in scan:
+        return None
+    try:
+        return float(numpy.asarray(scan[path][()]).flat[0])
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def get_CLI_options():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+
+    parser.add_argument('master_file',
+                    action='store',
+                    help="master HDF5 file (created if it does not exist)")
+
+    parser.add_argument('hdf5_files',
+                    action='store',
+                    nargs='+',
+                    help="fly scan HDF5 file(s) to add")
+
+    return parser.parse_args()
+
+
+def main():
+    cli_options = get_CLI_options()
+    master = FlyScanMasterFile(cli_options.master_file)
+    for fname in cli_options.hdf5_files:
+        n = master.add_scan(fname)
+        print(f"{n:4d}  {fname}")
+
+
+if __name__ == '__main__':
+    main()
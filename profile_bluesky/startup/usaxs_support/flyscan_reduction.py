@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+
+"""
+reduce the raw data of a USAXS fly scan file to R(Q)
+
+The fly scan file (written by ``saveFlyData.SaveFlyScan``) holds:
+
+* the Struck MCA arrays (per channel):
+  ``mca1`` (clock pulses), ``mca2`` (I0 counts), ``mca3`` (upd counts)
+* the amplifier gain changes during the scan (``changes_*_mcsChan``
+  and ``changes_*_ampGain``, from the amplifier sequence program)
+* the gain and background of each amplifier range (``/entry/metadata``,
+  the ``DetectorAmplifierAutorangeDevice`` ranges)
+* the AR encoder readings (``changes_AR_*``) and trajectory
+  (``AR_PulsePositions``, ``AR_start``, ``AR_increment``)
+
+For each MCA channel (all steps are NumPy array operations):
+
+#. AR angle: interpolated from the encoder readings, or from the
+   trajectory pulse positions, or ``AR_start + AR_increment * i``
+#. amplifier range: from the gain changes; channels within
+   ``settling_time_s`` of a change are not used
+#. ``R = ((upd - upd_bkg*t) / upd_gain) / ((I0 - I0_bkg*t) / I0_gain)``
+   (backgrounds are count rates, ``t`` is the channel time)
+#. ``Q = angle2q(AR_center - AR, wavelength)``
+
+then R is averaged in log-spaced Q bins (``Q > 0``) and written
+to the same file, as ``/entry/flyScan_reduced:NXdata``.
+
+USAGE::
+
+    python ./flyscan_reduction.py flyscan_0001.h5 [--bins 250]
+
+PUBLIC
+
+    ~reduce_flyscan_file
+    ~read_flyscan
+    ~reduce
+    ~write_reduced
+
+INTERNAL
+
+    ~_angle2q
+    ~_valid_length
+    ~_channel_ranges
+    ~_scalar
+    ~_required
+"""
+
+import logging
+import numpy
+import os
+import time
+
+# do not warn if the HDF5 library version has changed
+os.environ['HDF5_DISABLE_VERSION_CHECK'] = '2'
+import h5py
+
+
+logger = logging.getLogger(os.path.split(__file__)[-1])
+
+REDUCED_GROUP_NAME = "flyScan_reduced"
+NUM_BINS = 250
+SETTLING_TIME_s = 0.01          # after an amplifier gain change
+MCA_CLOCK_FREQUENCY = 50e6      # default, when not in the file
+NUM_AMPLIFIER_RANGES = 5
+UPD_AMPLIFIERS = ("DLPCA200", "DDPCA300")   # upd_flyScan_amplifier: 0, 1
+
+
+def _angle2q(angle, wavelength):
+    """
+    angle (2theta, degrees) to Q (1/wavelength units)
+
+    as ``instrument.utils.a2q_q2a.angle2q()``, which cannot be
+    imported outside of the bluesky session (no EPICS, no IPython here)
+    """
+    return (4*numpy.pi/wavelength) * numpy.sin(angle*numpy.pi/2/180)
+
+
+def _scalar(group, name, default=None):
+    """first value of dataset ``name`` in ``group`` (or ``default``)"""
+    if name not in group:
+        return default
+    value = numpy.asarray(group[name][()])
+    if value.size == 0:
+        return default
+    value = value.flat[0]
+    if isinstance(value, bytes):
+        value = value.decode("utf8", errors="replace")
+    return value
+
+
+def _required(group, name):
+    """first value of dataset ``name`` in ``group``, KeyError if not there"""
+    value = _scalar(group, name)
+    if value is None:
+        raise KeyError(f"required metadata not in {group.name}: {name}")
+    return value
+
+
+def _valid_length(channels):
+    """
+    number of valid records in a ``changes_*_mcsChan`` array
+
+    The sequence program fills the arrays from the start, MCS channel
+    numbers increase.  The rest of the array is left over (zeros).
+    """
+    channels = numpy.asarray(channels)
+    if channels.size == 0:
+        return 0
+    stop = numpy.flatnonzero(numpy.diff(channels) <= 0)
+    return channels.size if stop.size == 0 else int(stop[0]) + 1
+
+
+def _channel_ranges(num_channels, mcs_chan, amp_gain):
+    """
+    amplifier range of each MCS channel, from the gain change records
+
+    :return: (range of each channel, index of the last change
+        before each channel (-1: none), channels of the changes)
+    """
+    k = _valid_length(mcs_chan)
+    if k == 0:
+        zeros = numpy.zeros(num_channels, dtype=int)
+        return zeros, zeros - 1, numpy.zeros(0, dtype=int)
+    changes = numpy.asarray(mcs_chan[:k], dtype=int)
+    ranges = numpy.clip(numpy.asarray(amp_gain[:k], dtype=int), 0, NUM_AMPLIFIER_RANGES - 1)
+    last = numpy.searchsorted(changes, numpy.arange(num_channels), side="right") - 1
+    # before the first record: the range of the first record
+    channel_range = ranges[numpy.clip(last, 0, None)]
+    return channel_range, last, changes
+
+
+def read_flyscan(entry):
+    """
+    read the raw data (needed for the reduction) of one fly scan
+
+    :param obj entry: h5py group of the NXentry in the fly scan file
+    :return: dict of arrays and values
+    :raises KeyError: metadata needed for the reduction is not in the file
+    :raises ValueError: unknown upd amplifier
+    """
+    fs = entry["flyScan"]
+    md = entry["metadata"]
+    mca3 = numpy.asarray(fs["mca3"][()], dtype=float)
+    n = mca3.size
+    raw = dict(
+        clock=numpy.asarray(fs["mca1"][()][:n], dtype=float),
+        I0=numpy.asarray(fs["mca2"][()][:n], dtype=float),
+        upd=mca3,
+        clock_frequency=float(_scalar(fs, "mca_clock_frequency", MCA_CLOCK_FREQUENCY)),
+        wavelength=float(
+            _scalar(entry, "instrument/monochromator/wavelength")
+            or _required(md, "DCM_wavelength")),
+        ar_center=float(_required(md, "AR_center")),
+    )
+
+    amp = int(_required(fs, "upd_flyScan_amplifier"))
+    if not 0 <= amp < len(UPD_AMPLIFIERS):
+        raise ValueError(f"unknown upd_flyScan_amplifier: {amp}")
+    amp = UPD_AMPLIFIERS[amp]
+    raw["upd_amplifier"] = amp
+    for key, prefix in (("upd", amp), ("I0", "I0")):
+        raw[f"{key}_gain"] = numpy.array([
+            float(_required(md, f"{prefix}_gain{r}"))
+            for r in range(NUM_AMPLIFIER_RANGES)
+        ])
+        raw[f"{key}_bkg"] = numpy.array([
+            float(_required(md, f"{prefix}_bkg{r}"))
+            for r in range(NUM_AMPLIFIER_RANGES)
+        ])
+        for item in ("mcsChan", "ampGain"):
+            name = f"changes_{prefix}_{item}"
+            raw[f"{key}_{item}"] = fs[name][()] if name in fs else numpy.zeros(0)
+
+    raw["encoder_channel"] = fs["changes_AR_PSOpulse"][()] if "changes_AR_PSOpulse" in fs else numpy.zeros(0)
+    raw["encoder_angle"] = fs["changes_AR_angle"][()] if "changes_AR_angle" in fs else numpy.zeros(0)
+    raw["pulse_positions"] = numpy.atleast_1d(fs["AR_PulsePositions"][()]) if "AR_PulsePositions" in fs else numpy.zeros(0)
+    raw["ar_start"] = _scalar(fs, "AR_start")           # None: not in the file
+    raw["ar_increment"] = _scalar(fs, "AR_increment")
+    return raw
+
+
+def _channel_angles(raw, n):
+    """AR angle of each MCS channel and the method used"""
+    channel = numpy.arange(n, dtype=float)
+    k = _valid_length(raw["encoder_channel"])
+    if k > 1:
+        # encoder readings (about 10 Hz) at known MCS channels
+        x = numpy.asarray(raw["encoder_channel"][:k], dtype=float)
+        y = numpy.asarray(raw["encoder_angle"][:k], dtype=float)
+        return numpy.interp(channel + 0.5, x, y), "encoder"
+    pulses = numpy.asarray(raw["pulse_positions"], dtype=float)
+    if pulses.size > n:
+        # channel i is between pulses i and i+1
+        return 0.5 * (pulses[:n] + pulses[1:n+1]), "trajectory"
+    if pulses.size == n and n > 1:
+        return pulses, "trajectory"
+    if raw["ar_start"] is None or raw["ar_increment"] is None:
+        raise KeyError("no AR encoder readings, trajectory, or AR_start & AR_increment")
+    ar_start = float(raw["ar_start"])
+    ar_increment = float(raw["ar_increment"])
+    return ar_start + ar_increment * channel, "AR_start + AR_increment*i"
+
+
+def reduce(raw, num_bins=NUM_BINS, settling_time_s=SETTLING_TIME_s):
+    """
+    reduce the raw fly scan data to R(Q), log-spaced in Q
+
+    :param dict raw: from ``read_flyscan()``
+    :param int num_bins: number of log-spaced Q bins
+    :param float settling_time_s: ignore channels this soon
+        after an amplifier gain change
+    :return: dict of arrays (Q, R, R_errors, points) and values
+    """
+    if not raw["wavelength"] > 0:
+        raise ValueError(f"wavelength must be positive, received {raw['wavelength']}")
+    if not raw["clock_frequency"] > 0:
+        raise ValueError(f"clock frequency must be positive, received {raw['clock_frequency']}")
+    upd = raw["upd"]
+    n = upd.size
+    t = raw["clock"] / raw["clock_frequency"]
+    t_start = numpy.cumsum(t) - t
+
+    usable = t > 0
+    norm = {}
+    for key in ("upd", "I0"):
+        r, last, changes = _channel_ranges(n, raw[f"{key}_mcsChan"], raw[f"{key}_ampGain"])
+        gain = raw[f"{key}_gain"][r]
+        if not numpy.all(gain > 0):
+            bad = sorted(set(r[~(gain > 0)].tolist()))
+            raise ValueError(f"{key} gain must be positive, ranges {bad}: {raw[f'{key}_gain']}")
+        norm[key] = (raw[key] - raw[f"{key}_bkg"][r] * t) / gain
+        if key == "upd":
+            upd_gain = gain
+        if changes.size > 1:
+            # the first record is the range at the start, not a change
+            since = t_start - t_start[numpy.clip(changes, 0, n - 1)][numpy.clip(last, 0, None)]
+            usable &= ~((last >= 1) & (since < settling_time_s))
+
+    usable &= norm["I0"] > 0
+    ar, ar_method = _channel_angles(raw, n)
+    Q = _angle2q(raw["ar_center"] - ar, raw["wavelength"])
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        R = norm["upd"] / norm["I0"]
+        # counting statistics of upd
+        dR = numpy.sqrt(numpy.maximum(upd, 1)) / upd_gain / norm["I0"]
+    usable &= numpy.isfinite(R) & (Q > 0)
+
+    Q, R, dR = Q[usable], R[usable], dR[usable]
+    result = dict(
+        Q=numpy.zeros(0), R=numpy.zeros(0), R_errors=numpy.zeros(0),
+        points=numpy.zeros(0, dtype=int),
+        num_channels=n, num_used=int(Q.size),
+        ar_method=ar_method, upd_amplifier=raw["upd_amplifier"],
+        wavelength=raw["wavelength"], ar_center=raw["ar_center"],
+    )
+    if Q.size == 0:
+        return result
+
+    edges = numpy.geomspace(Q.min(), Q.max() * (1 + 1e-9), num_bins + 1)
+    bin_ = numpy.searchsorted(edges, Q, side="right") - 1
+    points = numpy.bincount(bin_, minlength=num_bins)[:num_bins]
+    occupied = points > 0
+    npts = points[occupied]
+
+    def sums(w):
+        return numpy.bincount(bin_, weights=w, minlength=num_bins)[:num_bins][occupied]
+
+    result.update(
+        Q=sums(Q) / npts,
+        R=sums(R) / npts,
+        R_errors=numpy.sqrt(sums(dR * dR)) / npts,
+        points=npts,
+    )
+    return result
+
+
+def write_reduced(entry, reduced, group_name=REDUCED_GROUP_NAME, **attrs):
+    """write (replace) the reduced data as a NXdata group in ``entry``"""
+    if group_name in entry:
+        del entry[group_name]
+    nxdata = entry.create_group(group_name)
+    nxdata.attrs["NX_class"] = "NXdata"
+    nxdata.attrs["canSAS_class"] = "SASdata"
+    nxdata.attrs["signal"] = "R"
+    nxdata.attrs["axes"] = "Q"
+    nxdata.attrs["Q_indices"] = 0
+    for key, value in attrs.items():
+        nxdata.attrs[key] = value
+    for key in ("num_channels", "num_used", "ar_method", "upd_amplifier"):
+        nxdata.attrs[key] = reduced[key]
+
+    ds = nxdata.create_dataset("Q", data=reduced["Q"])
+    ds.attrs["units"] = "1/angstrom"
+    ds = nxdata.create_dataset("R", data=reduced["R"])
+    ds.attrs["uncertainties"] = "R_errors"
+    nxdata.create_dataset("R_errors", data=reduced["R_errors"])
+    ds = nxdata.create_dataset("points", data=reduced["points"])
+    ds.attrs["long_name"] = "MCS channels averaged in each Q bin"
+    ds = nxdata.create_dataset("wavelength", data=reduced["wavelength"])
+    ds.attrs["units"] = "angstrom"
+    ds = nxdata.create_dataset("AR_center", data=reduced["ar_center"])
+    ds.attrs["units"] = "degrees"
+    return nxdata
+
+
+def reduce_flyscan_file(hdf5_file, num_bins=NUM_BINS, settling_time_s=SETTLING_TIME_s,
+                        group_name=REDUCED_GROUP_NAME):
+    """
+    reduce a (closed) fly scan file, write R(Q) into the same file
+
+    :return: dict from ``reduce()``
+    """
+    t0 = time.time()
+    with h5py.File(hdf5_file, "r+") as f:
+        entry = f["/entry"]
+        reduced = reduce(read_flyscan(entry), num_bins=num_bins, settling_time_s=settling_time_s)
+        write_reduced(
+            entry, reduced, group_name=group_name,
+            num_bins=num_bins, settling_time_s=settling_time_s)
+    logger.info(
+        "reduced %s: %d of %d channels in %d Q bins (%.3f s)",
+        hdf5_file, reduced["num_used"], reduced["num_channels"],
+        len(reduced["Q"]), time.time() - t0)
+    return reduced
+
+
+def get_CLI_options():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+
+    parser.add_argument('hdf5_files',
+                    action='store',
+                    nargs='+',
+                    help="fly scan HDF5 file(s)")
+
+    parser.add_argument('--bins',
+                    action='store',
+                    type=int,
+                    default=NUM_BINS,
+                    help="number of log-spaced Q bins")
+
+    parser.add_argument('--settling-time',
+                    action='store',
+                    type=float,
+                    default=SETTLING_TIME_s,
+                    help="ignore channels within this time (s) after a gain change")
+
+    return parser.parse_args()
+
+
+def main():
+    cli_options = get_CLI_options()
+    for fname in cli_options.hdf5_files:
+        reduced = reduce_flyscan_file(
+            fname, num_bins=cli_options.bins,
+            settling_time_s=cli_options.settling_time)
+        print(
+            f"{fname}: {reduced['num_used']}/{reduced['num_channels']} channels,"
+            f" {len(reduced['Q'])} Q bins, AR from {reduced['ar_method']}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
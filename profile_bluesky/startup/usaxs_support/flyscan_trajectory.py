@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+USAXS fly scan trajectories (AR, AY, DY, ASRP), computed with NumPy
+
+The AR trajectory has the step-size distribution of a step scan
+(``ustep.Ustep``), from ``start`` to ``finish``.  AY and DY track
+the scattered beam, with the geometry of ``uascan()``::
+
+    ay = AY0 + SAD * tan(ar - center)
+    dy = DY0 + SDD * tan(ar - center)
+
+For side-bounce USAXS, the ASRP piezo (VDC) corrects the Bragg angle::
+
+    asrp = ASRP0 - (atan(tan(center) / cos(center - ar)) - center) / degrees_per_VDC
+
+Results are cached, keyed by the parameters.  The arrays returned
+are shared by all callers of the same parameters: they are read-only.
+
+USAGE::
+
+    python ./flyscan_trajectory.py 10.8 10.0 9.0 10000 1.2 0.0001
+
+PUBLIC
+
+    ~compute_trajectories
+"""
+
+import functools
+import logging
+import numpy
+import os
+
+try:
+    from ustep import Ustep     # when run standalone
+except ImportError:
+    from .ustep import Ustep    # when imported in a package
+
+
+logger = logging.getLogger(os.path.split(__file__)[-1])
+
+CACHE_SIZE = 32
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def compute_trajectories(
+        start, center, finish, num_points, exponent, min_step,
+        ay0=0, sad=0, dy0=0, sdd=0,
+        asrp0=None, asrp_degrees_per_VDC=None):
+    """
+    compute the fly scan trajectories (cached)
+
+    :param float start: first AR position (degrees)
+    :param float center: AR of the beam center, at Q=0 (degrees)
+    :param float finish: last AR position (degrees)
+    :param int num_points: number of positions in each trajectory
+    :param float exponent: step size exponent (``terms.USAXS.uaterm``)
+    :param float min_step: smallest AR step (degrees)
+    :param float ay0: AY at the beam center (mm)
+    :param float sad: sample to analyzer distance (mm)
+    :param float dy0: DY at the beam center (mm)
+    :param float sdd: sample to detector distance (mm)
+    :param float asrp0: ASRP at the beam center (VDC),
+        ``None``: no ASRP trajectory (not side-bounce)
+    :param float asrp_degrees_per_VDC: ASRP calibration
+    :return: dict of read-only arrays: ``ar``, ``ay``, ``dy``
+        (and ``asrp``, if ``asrp0`` is given)
+    """
+    num_points = int(num_points)
+    if num_points < 2:
+        raise ValueError(f"need at least 2 trajectory points, received {num_points}")
+
+    ar = numpy.empty(num_points)
+    ar[0] = start
+    ar[1:] = Ustep(start, center, finish, num_points - 1, exponent, min_step).series()
+
+    tan_angle = numpy.tan(numpy.radians(ar - center))
+    trajectories = dict(
+        ar=ar,
+        ay=ay0 + sad * tan_angle,
+        dy=dy0 + sdd * tan_angle,
+    )
+    if asrp0 is not None and asrp_degrees_per_VDC:
+        bragg = numpy.degrees(
+            numpy.arctan(
+                numpy.tan(numpy.radians(center))
+                / numpy.cos(numpy.radians(center - ar))))
+        trajectories["asrp"] = asrp0 - (bragg - center) / asrp_degrees_per_VDC
+
+    for arr in trajectories.values():
+        arr.flags.writeable = False     # cached: shared by all callers
+    return trajectories
+
+
+def get_CLI_options():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+
+    for name in "start center finish num_points exponent min_step".split():
+        parser.add_argument(name, action='store', type=float)
+
+    return parser.parse_args()
+
+
+def main():
+    import time
+    args = get_CLI_options()
+    t0 = time.time()
+    trajectories = compute_trajectories(
+        args.start, args.center, args.finish,
+        int(args.num_points), args.exponent, args.min_step)
+    print(f"{len(trajectories['ar'])} points in {(time.time()-t0)*1000:.1f} ms")
+    for key, arr in trajectories.items():
+        print(f"{key}: {arr[0]} .. {arr[-1]}")
+
+
+if __name__ == '__main__':
+    main()
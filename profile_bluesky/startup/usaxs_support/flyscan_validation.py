@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+"""
+check the data integrity of a USAXS fly scan (the Struck MCA arrays)
+
+Checks (each one a few NumPy array operations, for all channels):
+
+``clock_gaps``
+    channel time (``mca1``, clock pulses) much longer than both
+    neighbors: a dropped (missed) pulse joined two channels
+``stuck_counters``
+    the same ``mca2`` (I0) or ``mca3`` (upd) count in many
+    consecutive channels: the counter did not update
+``zero_I0``
+    no I0 counts (``mca2``): cannot normalize the channel
+``non_monotonic_time``
+    channel time not positive: the time of the channels
+    does not increase
+``missing_channels``
+    fewer channels recorded than trajectory pulses expected
+
+The quality score is the fraction of the expected channels
+that pass all checks (1.0: no problems found).
+
+USAGE::
+
+    python ./flyscan_validation.py flyscan_0001.h5
+
+PUBLIC
+
+    ~validate
+    ~validate_flyscan_file
+
+INTERNAL
+
+    ~_long_runs
+"""
+
+import logging
+import numpy
+import os
+
+# do not warn if the HDF5 library version has changed
+os.environ['HDF5_DISABLE_VERSION_CHECK'] = '2'
+import h5py
+
+
+logger = logging.getLogger(os.path.split(__file__)[-1])
+
+MCA_PATHS = (
+    "/entry/flyScan/mca1",      # clock
+    "/entry/flyScan/mca2",      # I0
+    "/entry/flyScan/mca3",      # upd
+)
+NUM_PULSES_PATH = "/entry/flyScan/AR_NumPulsePositions"
+CLOCK_GAP_FACTOR = 1.8      # channel time / longest neighbor channel time
+STUCK_RUN_LENGTH = 10       # consecutive channels with identical counts
+CHECKS = (
+    "clock_gaps",
+    "stuck_counters",
+    "zero_I0",
+    "non_monotonic_time",
+    "missing_channels",
+)
+
+
+def _long_runs(counts, run_length):
+    """mask: channels in runs of at least ``run_length`` identical values"""
+    n = counts.size
+    if n == 0:
+        return numpy.zeros(0, dtype=bool)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(counts)) + 1))
+    lengths = numpy.diff(numpy.append(starts, n))
+    return numpy.repeat(lengths >= run_length, lengths)
+
+
+def validate(clock, I0, upd, expected_channels=None,
+             clock_gap_factor=CLOCK_GAP_FACTOR, stuck_run_length=STUCK_RUN_LENGTH):
+    """
+    check the MCA arrays of one fly scan
+
+    :param clock: ``mca1``, clock pulses in each channel
+    :param I0: ``mca2``, I0 counts in each channel
+    :param upd: ``mca3``, upd counts in each channel
+    :param int expected_channels: number of trajectory pulses
+        (``AR_NumPulsePositions``), ``None`` if not known
+    :return: dict with ``score`` (0..1), the number of channels
+        failing each check, ``channels`` and ``expected_channels``
+    """
+    clock = numpy.asarray(clock, dtype=float).ravel()
+    n = clock.size
+    I0 = numpy.asarray(I0, dtype=float).ravel()[:n]
+    upd = numpy.asarray(upd, dtype=float).ravel()[:n]
+
+    flags = {}
+    if n > 2:
+        neighbors = numpy.maximum(
+            numpy.concatenate(([clock[1]], clock[:-1])),
+            numpy.concatenate((clock[1:], [clock[-2]])))
+        flags["clock_gaps"] = clock > clock_gap_factor * neighbors
+    else:
+        flags["clock_gaps"] = numpy.zeros(n, dtype=bool)
+    flags["stuck_counters"] = (
+        _long_runs(I0, stuck_run_length) | _long_runs(upd, stuck_run_length))
+    flags["zero_I0"] = I0 <= 0
+    flags["non_monotonic_time"] = clock <= 0
+
+    bad = numpy.zeros(n, dtype=bool)
+    for mask in flags.values():
+        bad |= mask
+
+    expected = int(expected_channels or 0)
+    missing = max(expected - n, 0)
+    total = max(expected, n)
+
+    result = {key: int(mask.sum()) for key, mask in flags.items()}
+    result["missing_channels"] = missing
+    result["channels"] = n
+    result["expected_channels"] = expected
+    result["score"] = 0.0 if total == 0 else 1.0 - (int(bad.sum()) + missing) / total
+    return result
+
+
+def validate_flyscan_file(hdf5_file):
+    """check the MCA arrays in a fly scan file, return ``validate()`` result"""
+    with h5py.File(hdf5_file, "r") as f:
+        expected = None
+        if NUM_PULSES_PATH in f:
+            expected = numpy.asarray(f[NUM_PULSES_PATH][()]).flat[0]
+        arrays = [f[path][()] for path in MCA_PATHS]
+        return validate(*arrays, expected_channels=expected)
+
+
+def get_CLI_options():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+
+    parser.add_argument('hdf5_files',
+                    action='store',
+                    nargs='+',
+                    help="fly scan HDF5 file(s)")
+
+    return parser.parse_args()
+
+
+def main():
+    cli_options = get_CLI_options()
+    for fname in cli_options.hdf5_files:
+        quality = validate_flyscan_file(fname)
+        problems = ", ".join(f"{k}={quality[k]}" for k in CHECKS if quality[k] > 0)
+        print(f"{fname}: score={quality['score']:.4f}  {problems or 'no problems'}")
+
+
+if __name__ == '__main__':
+    main()
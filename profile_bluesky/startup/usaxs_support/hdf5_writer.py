@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+"""
+out-of-process HDF5 writer for the USAXS fly scan files
+
+All h5py calls are made in a separate (writer) process.  The
+client (in the bluesky/IPython process) sends messages over a
+pipe.  h5py holds a global lock while it works, with the writer
+process, that lock is not taken in the RunEngine process.
+
+The client side presents the small part of the h5py API
+used by ``saveFlyData.SaveFlyScan``::
+
+    writer = HDF5WriterService()
+    f = writer.File("/tmp/test.h5", "w")
+    g = f.create_group("entry")
+    g.attrs["NX_class"] = "NXentry"
+    ds = g.create_dataset("data", data=[1, 2, 3])
+    f.close()
+
+Each call waits for the writer to reply, so h5py exceptions are
+raised in the caller.  Only the calling thread waits; it does not
+hold the Python GIL while waiting.
+
+PUBLIC
+
+    ~HDF5WriterService
+
+INTERNAL
+
+    ~_serve
+    ~_RemoteAttrs
+    ~_RemoteNode
+    ~_RemoteGroup
+    ~_RemoteDataset
+    ~_RemoteFile
+"""
+
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+
+
+logger = logging.getLogger(os.path.split(__file__)[-1])
+
+
+def _serve(connection):
+    """
+    writer process: run the h5py calls requested by the client
+
+    Each message is a tuple: ``(op, file_id, path, args, kwargs)``.
+    Each reply is a tuple: ``(ok, result)``.
+    """
+    # do not warn if the HDF5 library version has changed
+    os.environ['HDF5_DISABLE_VERSION_CHECK'] = '2'
+    import h5py
+
+    files = {}
+
+    def _kind(obj):
+        if isinstance(obj, h5py.Dataset):
+            return "dataset"
+        return "group"
+
+    def _run(op, file_id, path, args, kwargs):
+        if op == "open":
+            files[file_id] = h5py.File(*args, **kwargs)
+            return None
+        f = files[file_id]
+        if op == "close":
+            files.pop(file_id).close()
+            return None
+        if op == "flush":
+            f.flush()
+            return None
+        if op == "swmr_mode":
+            f.swmr_mode = args[0]
+            return None
+        obj = f[path]
+        if op == "create_group":
+            obj.create_group(*args, **kwargs)
+            return None
+        if op == "create_dataset":
+            obj.create_dataset(*args, **kwargs)
+            return None
+        if op == "link":
+            # args: new name, path of existing object
+            obj[args[0]] = f[args[1]]
+            return None
+        if op == "kind":
+            return _kind(obj[args[0]]) if args[0] in obj else None
+        if op == "attr_set":
+            obj.attrs[args[0]] = args[1]
+            return None
+        if op == "attr_get":
+            return obj.attrs[args[0]]
+        if op == "attr_contains":
+            return args[0] in obj.attrs
+        if op == "attr_keys":
+            return list(obj.attrs.keys())
+        if op == "ds_write":
+            obj[args[0]] = args[1]
+            return None
+        if op == "ds_read":
+            return obj[args[0]]
+        if op == "ds_resize":
+            obj.resize(*args, **kwargs)
+            return None
+        if op == "ds_flush":
+            obj.flush()
+            return None
+        if op == "ds_info":
+            return obj.shape, obj.dtype
+        raise ValueError(f"unknown HDF5 writer operation: {op}")
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        try:
+            reply = True, _run(*message)
+        except Exception as exc:
+            reply = False, exc
+        try:
+            connection.send(reply)
+        except Exception as exc:    # such as: cannot pickle the exception
+            connection.send((False, RuntimeError(f"{reply[1]!r}: {exc}")))
+
+    for f in files.values():
+        f.close()
+
+
+class HDF5WriterService(object):
+    """
+    client: start and talk to the HDF5 writer process
+
+    The writer process is started when first needed and runs
+    until ``stop()`` is called (or this process exits).
+    """
+
+    def __init__(self):
+        self._connection = None
+        self._process = None
+        self._lock = threading.Lock()
+        self._file_ids = itertools.count(1)
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        """start the writer process (if not running)"""
+        if self.running:
+            return
+        # "spawn": do not fork the threads of this (EPICS) process
+        ctx = multiprocessing.get_context("spawn")
+        self._connection, child = ctx.Pipe()
+        self._process = ctx.Process(
+            target=_serve, args=(child,), name="HDF5WriterService", daemon=True)
+        self._process.start()
+        child.close()
+        logger.debug("HDF5 writer process started: pid=%d", self._process.pid)
+
+    def stop(self):
+        """stop the writer process, closing any open files"""
+        if not self.running:
+            return
+        with self._lock:
+            self._connection.send(None)
+        self._process.join()
+        self._connection.close()
+        self._process = None
+        logger.debug("HDF5 writer process stopped")
+
+    def call(self, op, file_id, path, *args, **kwargs):
+        """send one request to the writer process and return its result"""
+        self.start()
+        with self._lock:
+            self._connection.send((op, file_id, path, args, kwargs))
+            ok, result = self._connection.recv()
+        if not ok:
+            raise result
+        return result
+
+    def File(self, name, mode="r", **kwargs):
+        """open an HDF5 file in the writer process, like ``h5py.File()``"""
+        file_id = next(self._file_ids)
+        self.call("open", file_id, None, name, mode, **kwargs)
+        return _RemoteFile(self, file_id, name)
+
+
+def _decode(key):
+    """h5py accepts bytes as names, so do we"""
+    if isinstance(key, bytes):
+        key = key.decode("utf8")
+    return key
+
+
+class _RemoteAttrs(object):
+    """``.attrs`` of an HDF5 object in the writer process"""
+
+    def __init__(self, node):
+        self._node = node
+
+    def _call(self, op, *args):
+        return self._node._call(op, *args)
+
+    def __setitem__(self, key, value):
+        self._call("attr_set", _decode(key), value)
+
+    def __getitem__(self, key):
+        return self._call("attr_get", _decode(key))
+
+    def __contains__(self, key):
+        return self._call("attr_contains", _decode(key))
+
+    def keys(self):
+        return self._call("attr_keys")
+
+
+class _RemoteNode(object):
+    """an HDF5 object (by absolute path) in the writer process"""
+
+    def __init__(self, service, file_id, name):
+        self._service = service
+        self._file_id = file_id
+        self.name = name
+        self.attrs = _RemoteAttrs(self)
+
+    def _call(self, op, *args, **kwargs):
+        return self._service.call(op, self._file_id, self.name, *args, **kwargs)
+
+    def _path(self, key):
+        key = _decode(key)
+        if key.startswith("/"):
+            return key
+        return self.name.rstrip("/") + "/" + key
+
+
+class _RemoteGroup(_RemoteNode):
+    """an HDF5 group in the writer process"""
+
+    def __getitem__(self, key):
+        path = self._path(key)
+        kind = self._service.call("kind", self._file_id, "/", path)
+        if kind is None:
+            raise KeyError(f"object '{path}' does not exist")
+        if kind == "dataset":
+            return _RemoteDataset(self._service, self._file_id, path)
+        return _RemoteGroup(self._service, self._file_id, path)
+
+    def __setitem__(self, key, value):
+        if isinstance(value, _RemoteNode):
+            self._call("link", _decode(key), value.name)
+        else:
+            self._call("create_dataset", _decode(key), data=value)
+
+    def __contains__(self, key):
+        return self._service.call("kind", self._file_id, "/", self._path(key)) is not None
+
+    def create_group(self, name, **kwargs):
+        self._call("create_group", _decode(name), **kwargs)
+        return _RemoteGroup(self._service, self._file_id, self._path(name))
+
+    def create_dataset(self, name, **kwargs):
+        self._call("create_dataset", _decode(name), **kwargs)
+        return _RemoteDataset(self._service, self._file_id, self._path(name))
+
+
+class _RemoteDataset(_RemoteNode):
+    """an HDF5 dataset in the writer process"""
+
+    def __getitem__(self, key):
+        return self._call("ds_read", key)
+
+    def __setitem__(self, key, value):
+        self._call("ds_write", key, value)
+
+    @property
+    def shape(self):
+        return self._call("ds_info")[0]
+
+    @property
+    def dtype(self):
+        return self._call("ds_info")[1]
+
+    def resize(self, size, axis=None):
+        self._call("ds_resize", size, axis=axis)
+
+    def flush(self):
+        self._call("ds_flush")
+
+
+class _RemoteFile(_RemoteGroup):
+    """an HDF5 file in the writer process"""
+
+    def __init__(self, service, file_id, filename):
+        super().__init__(service, file_id, "/")
+        self.filename = filename
+        self._swmr_mode = False
+
+    @property
+    def swmr_mode(self):
+        return self._swmr_mode
+
+    @swmr_mode.setter
+    def swmr_mode(self, value):
+        self._call("swmr_mode", value)
+        self._swmr_mode = value
+
+    def flush(self):
+        self._call("flush")
+
+    def close(self):
+        self._call("close")
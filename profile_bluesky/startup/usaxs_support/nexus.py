@@ -7,6 +7,7 @@ PUBLIC FUNCTIONS
 
     ~get_manager
     ~reset_manager
+    ~config_file_hash
 
 INTERNAL
 
@@ -20,13 +21,16 @@ INTERNAL
 
 """
 
+import hashlib
+import itertools
 import logging
 import os
+import pickle
 # ensure we have a location for the libca (& libCom) library
 os.environ["PYEPICS_LIBCA"] = "/APSshare/epics/base-7.0.3/lib/linux-x86_64/libca.so"
 
 from lxml import etree as lxml_etree
-from ophyd import Component, EpicsSignal
+from ophyd import EpicsSignal
 import socket
 import time
 
@@ -39,14 +43,45 @@ path = os.path.dirname(__file__)
 XML_CONFIGURATION_FILE = os.path.join(path, 'saveFlyData.xml')
 XSD_SCHEMA_FILE = os.path.join(path, 'saveFlyData.xsd')
 TRIGGER_POLL_INTERVAL_s = 0.1
+CONFIG_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "usaxs", "saveFlyData")
+CONFIG_CACHE_VERSION = 3    # change when the compiled configuration changes
 
 manager = None # singleton instance of NeXus_Structure
+signal_pool = {} # connected ophyd signals, kept for the session, key: PV name
+signal_metadata = {} # EPICS metadata of the pool signals, updated by CA events, key: PV name
+desc_pool = {} # monitored .DESC signals of the pool signals, key: PV name
+_signal_counter = itertools.count(1)  # unique ophyd names for pool signals
+
 
-    
 
+def _watch_metadata(pvname, signal):
+    """
+    keep the EPICS metadata of a pool signal in ``signal_metadata``
+
+    Units and type are updated by connection (and metadata) events of
+    the signal.  The description is updated by monitor events of the
+    ``.DESC`` field (a signal in ``desc_pool``).
+    No CA requests are made when writing a file.
+    """
+    metadata = signal_metadata.setdefault(
+        pvname, dict(description="", units="", type=""))
 
-class EpicsSignalDesc(EpicsSignal):
-    desc = Component(EpicsSignal, ".DESC")
+    def meta_cb(*args, units=None, connected=False, **kwargs):
+        if connected:
+            metadata["units"] = units or ""
+            # such as "time_double": report the EPICS field type: "double"
+            metadata["type"] = signal._read_pv.type.split("_")[-1]
+
+    def desc_cb(*args, value=None, **kwargs):
+        metadata["description"] = value or ""
+
+    signal.subscribe(meta_cb, event_type=signal.SUB_META)
+    if pvname.find(".") < 0:
+        desc = EpicsSignal(pvname + ".DESC", name=f"{signal.name}_desc", string=True)
+        desc.subscribe(desc_cb, event_type=desc.SUB_VALUE)
+        desc_pool[pvname] = desc
+    # else: includes a field as part of pvname
+    # cannot attach .DESC as suffix to this
 
 
 def reset_manager():
@@ -55,23 +90,45 @@ def reset_manager():
 
     The configuration file must be parsed the next time the
     structure manager object is requested using ``get_manager()``.
+    The connected EPICS signals are kept in the ``signal_pool``
+    so the PVs are not connected again.
     """
     global manager
     logger.debug("reset NeXus structure manager")
     manager = None
 
 
+def config_file_hash(config_file):
+    """return the SHA-256 hash of the content of ``config_file``"""
+    with open(config_file, "rb") as fp:
+        return hashlib.sha256(fp.read()).hexdigest()
+
+
 def get_manager(config_file):
     """
     return a reference to the NeXus structure manager
 
-    If the manager is not defined (``None``), then create a
-    new instance of ``NeXus_Structure()``.
+    If the manager is not defined (``None``), or the
+    configuration file (or its content) has changed,
+    then create a new instance of ``NeXus_Structure()``.
+
+    EPICS signals are kept for the whole session in the
+    ``signal_pool``, only PVs added (or renamed) in a changed
+    configuration file will be connected.
     """
     global manager
+    content_hash = config_file_hash(config_file)
+    if manager is not None:
+        if manager.config_filename != config_file:
+            logger.debug("configuration file changed: %s", config_file)
+            manager = None
+        elif manager.config_hash != content_hash:
+            logger.debug("configuration file content changed: %s", config_file)
+            manager = None
     if manager is None:
         logger.debug("create new NeXus structure manager instance")
         manager = NeXus_Structure(config_file)
+        manager.config_hash = content_hash
     return manager
 
 
@@ -82,14 +139,81 @@ class NeXus_Structure(object):
 
     def __init__(self, config_file):
         self.config_filename = config_file
+        self.config_hash = None
         self.configured = False
 
         self.field_registry = {}    # key: node/@label,        value: Field_Specification object
         self.group_registry = {}    # key: HDF5 absolute path, value: Group_Specification object
         self.link_registry = {}     # key: node/@label,        value: Link_Specification object
         self.pv_registry = {}       # key: node/@label,        value: PV_Specification object
+        self.group_index = {}       # key: XML element node,   value: Group_Specification object
+
+    # attributes of the compiled configuration, in addition to the registries
+    _compiled_attributes = (
+        "creator_version",
+        "trigger_pv",
+        "trigger_accepted_values",
+        "timeout_pv",
+        "trigger_poll_interval_s",
+        "field_registry",
+        "group_registry",
+        "link_registry",
+        "pv_registry",
+    )
 
     def _read_configuration(self):
+        """
+        read the configuration, from the compiled cache when possible
+
+        The compiled configuration (after validation and parsing)
+        is cached on disk, keyed by the hash of the XML and XSD files.
+        """
+        cache_file = self._compiled_cache_file()
+        if self._load_compiled(cache_file):
+            logger.debug(f"compiled configuration loaded: {cache_file}")
+        else:
+            self._parse_configuration()
+            self._save_compiled(cache_file)
+        self.configured = True
+
+    def _compiled_cache_file(self):
+        """name of the compiled configuration cache file"""
+        key = hashlib.sha256()
+        key.update(f"{CONFIG_CACHE_VERSION}".encode())
+        for fname in (self.config_filename, XSD_SCHEMA_FILE):
+            key.update(config_file_hash(fname).encode())
+        return os.path.join(CONFIG_CACHE_DIR, key.hexdigest() + ".pickle")
+
+    def _load_compiled(self, cache_file):
+        """load the compiled configuration, return True if successful"""
+        if not os.path.exists(cache_file):
+            return False
+        try:
+            with open(cache_file, "rb") as fp:
+                compiled = pickle.load(fp)
+        except Exception as exc:
+            logger.debug(f"could not load compiled configuration {cache_file}: {exc}")
+            return False
+        for key in self._compiled_attributes:
+            setattr(self, key, compiled[key])
+        return True
+
+    def _save_compiled(self, cache_file):
+        """save the compiled configuration (ignore any problems)"""
+        compiled = {
+            key: getattr(self, key)
+            for key in self._compiled_attributes
+        }
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}"
+            with open(tmp_file, "wb") as fp:
+                pickle.dump(compiled, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)    # atomic
+        except Exception as exc:
+            logger.debug(f"could not save compiled configuration {cache_file}: {exc}")
+
+    def _parse_configuration(self):
         # first, validate configuration file against an XML Schema
         path = os.path.split(os.path.abspath(__file__))[0]
         xml_schema_file = os.path.join(path, XSD_SCHEMA_FILE)
@@ -114,11 +238,11 @@ class NeXus_Structure(object):
         self.creator_version = root.attrib['version']
         logger.debug(f"XML file creator version: {self.creator_version}")
 
-        node = root.xpath('/saveFlyData/triggerPV')[0]
-        self.trigger_pv = node.attrib['pvname']
+        trigger_node = root.xpath('/saveFlyData/triggerPV')[0]
+        self.trigger_pv = trigger_node.attrib['pvname']
         acceptable_values = (
-            int(node.attrib['done_value']),
-            node.attrib['done_text'],
+            int(trigger_node.attrib['done_value']),
+            trigger_node.attrib['done_text'],
             )
         self.trigger_accepted_values = acceptable_values
 
@@ -134,7 +258,7 @@ class NeXus_Structure(object):
 
         # allow XML configuration to override default trigger_poll_interval_s
         default_value = float(xsd_node[0].get('default', TRIGGER_POLL_INTERVAL_s))
-        self.trigger_poll_interval_s = node.get('poll_time_s', default_value)
+        self.trigger_poll_interval_s = float(trigger_node.get('poll_time_s', default_value))
         logger.debug(f"trigger_poll_interval_s: {self.trigger_poll_interval_s}")
 
         nx_structure = root.xpath('/saveFlyData/NX_structure')[0]
@@ -150,18 +274,30 @@ class NeXus_Structure(object):
         for node in nx_structure.xpath('//link'):
             Link_Specification(node, self)
 
-        self.configured = True
-
     def _connect_ophyd(self):
-        for i, pv in enumerate(self.pv_registry.values()):
-            oname = f"metadata_{i+1:04d}"
-            if pv.pvname.find(".") < 0:
-                creator = EpicsSignalDesc
-            else:
-                # includes a field as p[art of pvname
-                # cannot attach .DESC as suffix to this
-                creator = EpicsSignal
-            pv.ophyd_signal = creator(pv.pvname, name=oname)
+        """
+        assign an ophyd signal to each PV, re-using the signal pool
+
+        Signals for PVs already in the pool (from a previous
+        configuration) are re-used, they are already connected.
+        Signals no longer in the configuration are removed from the pool.
+        """
+        pvnames = set()
+        for pv in self.pv_registry.values():
+            pvnames.add(pv.pvname)
+            if pv.pvname not in signal_pool:
+                oname = f"metadata_{next(_signal_counter):04d}"
+                signal_pool[pv.pvname] = EpicsSignal(pv.pvname, name=oname)
+                _watch_metadata(pv.pvname, signal_pool[pv.pvname])
+            pv.ophyd_signal = signal_pool[pv.pvname]
+
+        for pvname in list(signal_pool.keys()):
+            if pvname not in pvnames:
+                logger.debug("remove PV from signal pool: %s", pvname)
+                signal_pool.pop(pvname).destroy()
+                if pvname in desc_pool:
+                    desc_pool.pop(pvname).destroy()
+                signal_metadata.pop(pvname, None)
 
     @property
     def connected(self):
@@ -184,13 +320,24 @@ class NeXus_Structure(object):
 
 def getGroupObjectByXmlNode(xml_node, manager):
     '''locate a Group_Specification object by matching its xml_node'''
-    for group_spec_obj in manager.group_registry.values():
-        if group_spec_obj.xml_node == xml_node:
-            return group_spec_obj
-    return None
+    return manager.group_index.get(xml_node)
+
+
+class _Specification(object):
+    '''common support for the specification classes'''
+
+    # attributes not kept in the compiled configuration cache
+    _transient_attributes = ("xml_node", "ophyd_signal", "hdf5_group", "pv")
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for key in self._transient_attributes:
+            if key in state:
+                state[key] = None
+        return state
 
-class Field_Specification(object):
+
+class Field_Specification(_Specification):
     '''specification of the "field" element in the XML configuration file'''
 
     def __init__(self, xml_element_node, manager):
@@ -220,7 +367,7 @@ class Field_Specification(object):
         return nm
 
 
-class Group_Specification(object):
+class Group_Specification(_Specification):
     '''specification of the "group" element in the XML configuration file'''
 
     def __init__(self, xml_element_node, manager):
@@ -254,12 +401,13 @@ class Group_Specification(object):
                 self.hdf5_path, self.name, self.nx_class)
             raise RuntimeError(msg)
         manager.group_registry[self.hdf5_path] = self
+        manager.group_index[xml_element_node] = self
 
     def __str__(self):
         return self.hdf5_path or 'Group_Specification object'
 
 
-class Link_Specification(object):
+class Link_Specification(_Specification):
     '''specification of the "link" element in the XML configuration file'''
 
     def __init__(self, xml_element_node, manager):
@@ -302,7 +450,7 @@ class Link_Specification(object):
         return nm
 
 
-class PV_Specification(object):
+class PV_Specification(_Specification):
     '''specification of the "PV" element in the XML configuration file'''
 
     def __init__(self, xml_element_node, manager):
@@ -321,6 +469,20 @@ class PV_Specification(object):
         aas = xml_element_node.attrib.get('acquire_after_scan', 'false')
         self.acquire_after_scan = aas.lower() in ('t', 'true')
 
+        # HDF5 storage options for array data, keyword arguments of create_dataset()
+        self.storage = {}
+        chunks = xml_element_node.get('chunks', None)
+        if chunks is not None:
+            self.storage["chunks"] = (int(chunks),)
+        compression = xml_element_node.get('compression', 'none')
+        if compression != 'none':
+            self.storage["compression"] = compression
+            level = xml_element_node.get('compression_level', None)
+            if compression == 'gzip' and level is not None:
+                self.storage["compression_opts"] = int(level)
+        if xml_element_node.get('shuffle', 'false').lower() in ('t', 'true', '1'):
+            self.storage["shuffle"] = True
+
         self.attrib = {}
         for node in xml_element_node.xpath('attribute'):
             self.attrib[node.attrib['name']] = node.attrib['value']
@@ -340,6 +502,21 @@ class PV_Specification(object):
         self.group_parent.group_children[self.hdf5_path] = self
         manager.pv_registry[self.hdf5_path] = self
 
+    @property
+    def description(self):
+        """EPICS .DESC field (from cache)"""
+        return signal_metadata.get(self.pvname, {}).get("description", "")
+
+    @property
+    def units(self):
+        """EPICS engineering units (from cache)"""
+        return signal_metadata.get(self.pvname, {}).get("units", "")
+
+    @property
+    def type(self):
+        """EPICS field type (from cache)"""
+        return signal_metadata.get(self.pvname, {}).get("type", "")
+
     def __str__(self):
         try:
             nm = self.label + ' <' + self.pvname + '>'
@@ -7,10 +7,13 @@ save EPICS data from USAXS Fly Scan to a NeXus file
 
 
 import datetime
+import hashlib
 import logging
 import numpy
 import os
+import shutil
 import sys
+import threading
 import time
 # from importlib import import_module
 
@@ -28,8 +31,12 @@ import h5py
 os.environ['EPICS_CA_MAX_ARRAY_BYTES'] = '1280000'    # was 200000000
 try:
     import nexus        # when run standalone
+    import flyscan_reduction
+    import flyscan_validation
 except ImportError:
     from . import nexus # when imported in a package
+    from . import flyscan_reduction
+    from . import flyscan_validation
 
 
 path = os.path.dirname(__file__)
@@ -49,13 +56,41 @@ class SaveFlyScan(object):
 
     trigger_pv = '9idcLAX:USAXSfly:Start'
     trigger_accepted_values = (0, 'Done')
-    trigger_poll_interval_s = 0.1
     scantime_pv = '9idcLAX:USAXS:FS_ScanTime'
     creator_version = 'unknown'
     flyScanNotSaved_pv = '9idcLAX:USAXS:FlyScanNotSaved'
-
-    def __init__(self, hdf5_file, config_file = None):
+    pv_read_timeout_s = 10
+    count_limited_reads = True  # read only length_limit elements of arrays
+    stream_interval_s = 1.0     # streaming: time between appends to the file
+    stream_chunk_size = 8192    # streaming: HDF5 chunk size (array elements)
+    use_skeleton = True         # create new files by copying a skeleton file
+    skeleton_version = 2        # change when the static file content changes
+    timing_group_name = "saveFlyData_timing"    # NXnote group, in the NXentry
+    quality_group_name = "flyScan_quality"      # NXnote group, in the NXentry
+
+    def __init__(self, hdf5_file, config_file = None, streaming = False, writer = None, reduce = False):
+        """
+        :param str hdf5_file: name of the new HDF5 file
+        :param str config_file: XML configuration file
+        :param bool streaming: append length-limited arrays
+            (the Struck MCA data) to the file *during* the fly scan
+        :param obj writer: instance of ``hdf5_writer.HDF5WriterService``
+            to make all h5py calls in a separate process,
+            ``None`` to make them in this process
+        :param bool reduce: after the file is closed, reduce the
+            data to R(Q) (``flyscan_reduction``) into the same file
+        """
         self.hdf5_file_name = hdf5_file
+        self.reduce = reduce
+        self.quality = None         # data integrity, see _validate()
+        self._preliminary_values = {}
+        self.pv_read_latency = {}
+        self.pv_write_time = {}     # key: HDF5 path
+        self.timing = {}            # time (s) of each phase, see _timing_phase()
+        self.streaming = streaming
+        self.writer = writer
+        self._stream = None
+        self._t_phase = time.time()
 
         path = self._get_support_code_dir()
         self.config_file = config_file or os.path.join(path, XML_CONFIGURATION_FILE)
@@ -67,125 +102,525 @@ class SaveFlyScan(object):
         """
         wait until the data is ready, then save it
 
+        Waits for a monitor event of the trigger PV.  Every
+        ``poll_time_s`` (of ``triggerPV`` in the XML configuration),
+        the last monitored value is checked too (in case an event
+        was missed, such as across a reconnect).
+        Raises ``TimeoutException`` if the trigger PV is not done
+        within the time given by the timeout PV.
+
         note: not for production use in bluesky
               this routine is used by SPEC and for development code
         """
         import epics
 
-        def keep_waiting():
-            triggered = self.trigger.get() in self.trigger_accepted_values
-            return not triggered
+        triggered = threading.Event()
+        accepted = self.mgr.trigger_accepted_values
 
-        self.trigger = epics.PV(self.trigger_pv)
+        def trigger_cb(value=None, char_value=None, **kwargs):
+            if value in accepted or char_value in accepted:
+                triggered.set()
+
+        self.trigger = epics.PV(self.mgr.trigger_pv, callback=trigger_cb)
         epics.caput(self.flyScanNotSaved_pv, 1)
         # file is open now, write preliminary data
         self.preliminaryWriteFile()
 
-        while keep_waiting():
-            time.sleep(self.trigger_poll_interval_s)
+        # wait for the trigger PV to report "done"
+        timeout = self._get_scan_timeout()
+        deadline = None if timeout is None else time.time() + timeout
+        while not triggered.wait(self.mgr.trigger_poll_interval_s):
+            value = self.trigger.get(use_monitor=True)
+            if value in accepted or self.trigger.char_value in accepted:
+                break
+            if deadline is not None and time.time() > deadline:
+                self.trigger.clear_callbacks()
+                raise TimeoutException(
+                    f"{self.mgr.trigger_pv} not done after {timeout} s"
+                    f" (from {self.mgr.timeout_pv})"
+                )
+        self.trigger.clear_callbacks()
 
         # write the remaining data and close the file
         self.saveFile()
         epics.caput(self.flyScanNotSaved_pv, 0)
 
+    def _get_scan_timeout(self):
+        """
+        time (s) to wait for the trigger PV, from the timeout PV
+
+        :return: ``None`` (wait forever) if the timeout PV
+            cannot be read or its value is not positive
+        """
+        import epics
+
+        timeout = epics.caget(self.mgr.timeout_pv, timeout=self.pv_read_timeout_s)
+        if timeout is None or timeout <= 0:
+            logger.debug("no scan timeout from %s: %s", self.mgr.timeout_pv, timeout)
+            return None
+        return float(timeout)
+
     def preliminaryWriteFile(self):
         """write all preliminary data to the file while fly scan is running"""
-        not_connected_PVs = self.mgr.unconnected_signals
-        for pv_spec in self.mgr.pv_registry.values():
-            if pv_spec.acquire_after_scan:
-                continue
-            elif pv_spec in not_connected_PVs:
-                logger.warning(
-                    "preliminaryWriteFile(): PV %s is not connected now",
-                    pv_spec.pvname
-                )
-                value = NOT_CONNECTED_TEXT
-                # continue
-            elif pv_spec.as_string:
-                value = pv_spec.ophyd_signal.get(as_string=True, timeout=10, use_monitor=False)
-            else:
-                value = pv_spec.ophyd_signal.get(timeout=10, use_monitor=False)
-            if value is None:
-                value = NO_DATA_TEXT
-            logger.debug("saveFile(): writing {pv_spec}")
-            if not isinstance(value, numpy.ndarray):
-                value = [value]
-            else:
-                lim = pv_spec.length_limit
-                pv_reg = self.mgr.pv_registry
-                if lim and lim in pv_reg:
-                    length_limit = pv_reg[lim].ophyd_signal.get()
-                    if len(value) > length_limit:
-                        value = value[:length_limit]
-
-            hdf5_parent = pv_spec.group_parent.hdf5_group
-            try:
-                logger.debug('preliminaryWriteFile(name="%s", data=%s)', pv_spec.label, value)
-                ds = makeDataset(hdf5_parent, pv_spec.label, value)
-                if ds is None:
-                    logger.debug(f"Could not create {pv_spec.label}")
-                    continue
-                self._attachEpicsAttributes(ds, pv_spec)
-                addAttributes(ds, **pv_spec.attrib)
-            except IOError as e:
-                logger.debug("preliminaryWriteFile():")
-                logger.debug("ERROR: pv_spec.label=%s, value=%s", pv_spec.label, str(value))
-                logger.debug("MESSAGE: %s", e)
-                logger.debug("RESOLUTION: writing as error message string")
-                makeDataset(hdf5_parent, pv_spec.label, [str(e).encode('utf8')])
+        pv_specs = [
+            pv_spec
+            for pv_spec in self.mgr.pv_registry.values()
+            if not pv_spec.acquire_after_scan
+        ]
+        self._t_phase = time.time()
+        values = self._read_pv_values(pv_specs, "preliminaryWriteFile")
+        self._timing_phase("preliminary_read")
+        self._preliminary_values = values
+        for pv_spec in pv_specs:
+            value = values[pv_spec.hdf5_path]
+            self._write_pv_value(pv_spec, value, values, "preliminaryWriteFile")
+
+        if self.streaming:
+            self._start_streaming()
+        self._timing_phase("preliminary_write")
 
     def saveFile(self):
         '''write all desired data to the file and exit this code'''
+        if self.streaming:
+            self._stop_streaming()
+
+        # note: len(caget(array)) returns NORD (number of useful data)
+        pv_specs = [
+            pv_spec
+            for pv_spec in self.mgr.pv_registry.values()
+            if pv_spec.acquire_after_scan
+        ]
+        self._t_phase = time.time()
+        values = self._read_pv_values(pv_specs, "saveFile")
+        self._timing_phase("post_scan_read")
+        self.quality = self._validate(values)
+        self._timing_phase("validate")
+
+        if self._stream is not None:
+            # final flush of streamed data, then leave SWMR mode
+            self._append_streamed_data(values)
+            streamed = self._stream["pv_specs"]
+            pv_specs = [p for p in pv_specs if p not in streamed]
+            self._reopen_file()
+            self._stream = None
+
         t = datetime.datetime.now()
         timestamp = datetime.datetime.isoformat(t, sep=" ")
         f = self.mgr.group_registry['/'].hdf5_group
         f.attrs["timestamp"] = timestamp
 
-        # note: len(caget(array)) returns NORD (number of useful data)
+        for pv_spec in pv_specs:
+            value = values[pv_spec.hdf5_path]
+            self._write_pv_value(pv_spec, value, values, "saveFile")
+        self._timing_phase("post_scan_write")
+
+        # as the final step, make all the links as directed
+        for _k, v in self.mgr.link_registry.items():
+            v.make_link(f)
+        self._timing_phase("links")
+
+        self._write_quality_note()
+        self._write_timing_note()
+        f.close()    # be CERTAIN to close the file
+        self._timing_phase("close")
+        logger.debug("saveFile(): file closed")
+
+        if self.reduce:
+            try:
+                flyscan_reduction.reduce_flyscan_file(self.hdf5_file_name)
+            except Exception as exc:
+                # the raw data is saved, do not fail
+                logger.error("could not reduce %s: %s", self.hdf5_file_name, exc)
+            self._timing_phase("reduce")
+        logger.info(
+            "saveFlyData timing (s): %s  file=%s",
+            "  ".join(f"{k}={v:.4f}" for k, v in self.timing.items()),
+            self.hdf5_file_name,
+        )
+
+    def _timing_phase(self, phase):
+        """record the time (s) since the previous phase ended"""
+        t = time.time()
+        self.timing[phase] = t - self._t_phase
+        self._t_phase = t
+
+    def _entry_group(self):
+        """the (first) NXentry group of the file, for the NXnote groups"""
+        entries = [
+            xture
+            for key, xture in sorted(self.mgr.group_registry.items())
+            if xture.nx_class == "NXentry"
+        ]
+        return (entries or [self.mgr.group_registry['/']])[0].hdf5_group
+
+    def _validate(self, values):
+        """
+        check the data integrity of the MCA arrays (``flyscan_validation``)
+
+        :param dict values: values read by ``saveFile()``
+        :return: ``flyscan_validation.validate()`` result,
+            ``None`` if the arrays could not be checked
+        """
+        try:
+            arrays = [values[path] for path in flyscan_validation.MCA_PATHS]
+            expected = self._preliminary_values.get(flyscan_validation.NUM_PULSES_PATH)
+            try:
+                expected = int(numpy.asarray(expected).flat[0])
+            except (TypeError, ValueError, IndexError):
+                expected = None     # not connected: do not count missing channels
+            quality = flyscan_validation.validate(*arrays, expected_channels=expected)
+        except Exception as exc:
+            logger.warning("could not validate %s: %s", self.hdf5_file_name, exc)
+            return None
+        logger.debug("saveFile(): quality=%s", quality)
+        return quality
+
+    def _write_quality_note(self):
+        """write the data integrity checks (``self.quality``) in an NXnote group"""
+        if self.quality is None:
+            return
+        try:
+            note = self._entry_group().create_group(self.quality_group_name)
+            addAttributes(note, NX_class="NXnote")
+            makeDataset(
+                note, "description",
+                [b"flyscan_validation.py: data integrity checks of the MCA arrays"])
+            for key, value in self.quality.items():
+                makeDataset(note, key, [value])
+        except Exception as exc:
+            logger.warning("could not write quality note: %s", exc)
+
+    def _write_timing_note(self):
+        """
+        write the timing of this file (phases, each PV) in an NXnote group
+
+        The ``close`` phase is not known yet, it is only logged.
+        """
+        parent = self._entry_group()
+        try:
+            note = parent.create_group(self.timing_group_name)
+            addAttributes(note, NX_class="NXnote")
+            makeDataset(
+                note, "description",
+                [b"saveFlyData.py timing: each phase and each PV (seconds)"])
+            for phase, seconds in self.timing.items():
+                makeDataset(note, phase, [seconds], units="s")
+
+            paths = sorted(set(self.pv_read_latency) | set(self.pv_write_time))
+            if len(paths) > 0:
+                makeDataset(note, "pv", numpy.array([p.encode("utf8") for p in paths]))
+                for label, source in (
+                        ("pv_read_time", self.pv_read_latency),
+                        ("pv_write_time", self.pv_write_time)):
+                    data = numpy.array([source.get(p, numpy.nan) for p in paths])
+                    makeDataset(note, label, data, units="s")
+        except Exception as exc:
+            logger.warning("could not write timing note: %s", exc)
+
+    def _start_streaming(self):
+        """
+        start appending length-limited arrays to the file during the scan
+
+        The arrays (such as ``mca1..3``) are those acquired after the
+        scan with a ``length_limit`` PV (such as the Struck current
+        channel).  Each becomes a resizable, chunked dataset and the
+        file is switched to SWMR mode so a reader can follow the scan::
+
+            f = h5py.File(name, "r", libver="latest", swmr=True)
+            ds = f["/entry/flyScan/mca1"]
+            ds.refresh()    # repeat to get new data
+
+        A monitor on each ``length_limit`` PV tracks the number of
+        channels.  A thread appends any new elements every
+        ``stream_interval_s``.
+        """
+        pv_reg = self.mgr.pv_registry
+        pv_specs = [
+            pv_spec
+            for pv_spec in pv_reg.values()
+            if pv_spec.acquire_after_scan
+            and pv_spec.length_limit in pv_reg
+            and pv_spec not in self.mgr.unconnected_signals
+        ]
+        if len(pv_specs) == 0:
+            logger.warning("streaming: no length-limited PVs, not streaming")
+            return
+
+        stream = dict(
+            pv_specs=pv_specs,
+            written={p.hdf5_path: 0 for p in pv_specs},
+            channels={},
+            subscriptions={},
+            stop=threading.Event(),
+        )
+
+        def _channels_cb(value=None, obj=None, **kwargs):
+            stream["channels"][obj.name] = value
+
+        for pv_spec in pv_specs:
+            signal = pv_reg[pv_spec.length_limit].ophyd_signal
+            if signal.name not in stream["subscriptions"]:
+                stream["subscriptions"][signal.name] = (
+                    signal,
+                    signal.subscribe(_channels_cb)
+                )
+
+            value = pv_spec.ophyd_signal.get(use_monitor=False)
+            storage = dict(chunks=(self.stream_chunk_size,))
+            storage.update(pv_spec.storage)
+            ds = pv_spec.group_parent.hdf5_group.create_dataset(
+                pv_spec.label,
+                shape=(0,),
+                maxshape=(None,),
+                dtype=numpy.asarray(value).dtype,
+                **storage
+            )
+            self._attachEpicsAttributes(ds, pv_spec)
+            addAttributes(ds, **pv_spec.attrib)
+
+        f = self.mgr.group_registry['/'].hdf5_group
+        f.swmr_mode = True      # no new objects or attributes after this
+
+        self._stream = stream
+        stream["thread"] = threading.Thread(
+            target=self._stream_loop, name="SaveFlyScan_stream", daemon=True)
+        stream["thread"].start()
+        logger.debug("streaming %d arrays to %s", len(pv_specs), self.hdf5_file_name)
+
+    def _stream_loop(self):
+        """thread: append new data until stopped"""
+        stream = self._stream
+        while not stream["stop"].wait(self.stream_interval_s):
+            try:
+                self._append_streamed_data()
+            except Exception as exc:
+                logger.warning("streaming: %s", exc)
+
+    def _append_streamed_data(self, values=None):
+        """
+        append any new elements to the streamed datasets
+
+        :param dict values: final values (from ``_read_pv_values()``),
+            if ``None``, read the arrays now up to the monitored
+            number of channels
+        """
+        stream = self._stream
+        pv_reg = self.mgr.pv_registry
+        f = self.mgr.group_registry['/'].hdf5_group
+        for pv_spec in stream["pv_specs"]:
+            key = pv_spec.hdf5_path
+            written = stream["written"][key]
+            if values is None:
+                signal = pv_reg[pv_spec.length_limit].ophyd_signal
+                channels = stream["channels"].get(signal.name)
+                if channels is None or int(channels) == written:
+                    continue
+                value = pv_spec.ophyd_signal.get(use_monitor=False)
+                channels = int(channels)
+            else:
+                value = values[key]
+                channels = values.get(pv_spec.length_limit)
+                if not isinstance(value, numpy.ndarray):
+                    logger.warning("streaming: no final data for %s", pv_spec.pvname)
+                    continue
+                if not isinstance(channels, (int, float, numpy.number)):
+                    channels = len(value)
+                channels = int(channels)
+            if value is None:
+                continue
+            channels = min(channels, len(value))
+
+            ds = pv_spec.group_parent.hdf5_group[pv_spec.label]
+            if channels < written:
+                # new acquisition started since we began
+                written = 0
+            ds.resize((channels,))
+            if channels > written:
+                ds[written:channels] = value[written:channels]
+            ds.flush()
+            stream["written"][key] = channels
+        f.flush()
+
+    def _stop_streaming(self):
+        """stop the streaming thread and the channel monitors"""
+        stream = self._stream
+        if stream is None:
+            return
+        stream["stop"].set()
+        stream["thread"].join()
+        for signal, cid in stream["subscriptions"].values():
+            signal.unsubscribe(cid)
+
+    def _reopen_file(self):
+        """close the (SWMR) file and open it again to add new objects"""
+        f = self.mgr.group_registry['/'].hdf5_group
+        f.close()
+        f = self._open_hdf5_file("r+")
+        self._attach_hdf5_groups(f)
+
+    def _read_pv_values(self, pv_specs, caller):
+        """
+        read the values of all PVs in ``pv_specs`` as one batch
+
+        All the Channel Access get requests are issued at once
+        with a single flush of the CA send buffer, then the replies
+        are collected.  The reads share one deadline: a slow (or
+        missing) PV costs at most one timeout, not one per PV, and
+        does not block the other PVs.  The latency of each read is
+        kept in ``self.pv_read_latency`` (key: HDF5 path).
+
+        Arrays with a ``length_limit`` are read in a second batch,
+        after their limit PVs: only ``length_limit`` elements are
+        requested (a count-limited CA get), not the full array.
+        The values of the limit PVs are also returned.
+
+        :param [PV_Specification] pv_specs: PVs to be read
+        :param str caller: name of calling method, for log messages
+        :return: dict of values, keyed by ``pv_spec.hdf5_path``
+        """
+        pv_reg = self.mgr.pv_registry
+        t0 = time.time()
+        deadline = t0 + self.pv_read_timeout_s
+
+        limited = []
+        if self.count_limited_reads:
+            limited = [p for p in pv_specs if p.length_limit in pv_reg]
+        first = [p for p in pv_specs if p not in limited]
+        for lim in sorted(set(p.length_limit for p in limited)):
+            if pv_reg[lim] not in first:
+                first.append(pv_reg[lim])
+
+        values = self._read_batch(first, caller, t0, deadline)
+        if len(limited) > 0:
+            counts = {}
+            for pv_spec in limited:
+                count = values.get(pv_spec.length_limit)
+                if isinstance(count, (int, float, numpy.number)):
+                    counts[pv_spec.hdf5_path] = max(int(count), 0)
+            values.update(self._read_batch(limited, caller, t0, deadline, counts))
+
+        logger.debug(
+            "%s(): read %d PVs in %.3f s",
+            caller, len(values), time.time() - t0
+        )
+        return values
+
+    def _read_batch(self, pv_specs, caller, t0, deadline, counts=None):
+        """
+        read one batch of PVs, see ``_read_pv_values()``
+
+        :param [PV_Specification] pv_specs: PVs to be read
+        :param str caller: name of calling method, for log messages
+        :param float t0: time when the reading started
+        :param float deadline: time when the reading must end
+        :param dict counts: number of array elements to request,
+            keyed by ``pv_spec.hdf5_path`` (default: all),
+            0: an empty array (no CA get)
+        :return: dict of values, keyed by ``pv_spec.hdf5_path``
+        """
+        from epics import ca, dbr
+
+        counts = counts or {}
         not_connected_PVs = self.mgr.unconnected_signals
-        for pv_spec in self.mgr.pv_registry.values():
+        values = {}
+        pending = {}
+
+        for pv_spec in pv_specs:
+            key = pv_spec.hdf5_path
             if pv_spec in not_connected_PVs:
                 logger.warning(
-                    "saveFile(): PV %s is not connected now",
-                    pv_spec.pvname
+                    "%s(): PV %s is not connected now",
+                    caller, pv_spec.pvname
                 )
-                # value = NOT_CONNECTED_TEXT  # unused assignment
-                # continue
-            if not pv_spec.acquire_after_scan:
+                values[key] = NOT_CONNECTED_TEXT
+                self.pv_read_latency[key] = 0
                 continue
-            if pv_spec.as_string:
-                value = pv_spec.ophyd_signal.get(as_string=True)
-            else:
-                value = pv_spec.ophyd_signal.get()
+            chid = getattr(getattr(pv_spec.ophyd_signal, "_read_pv", None), "chid", None)
+            if chid is None:
+                # not a pyepics channel, read it the ophyd way
+                values[key] = pv_spec.ophyd_signal.get(
+                    as_string=pv_spec.as_string,
+                    timeout=self.pv_read_timeout_s,
+                    use_monitor=False,
+                )
+                self.pv_read_latency[key] = time.time() - t0
+                continue
+            count = counts.get(key)
+            if count == 0:
+                # CA count=0 means "all": do not ask, no elements
+                ftype = dbr.native_type(ca.field_type(chid))
+                values[key] = numpy.array([], dtype=dbr.NP_Map.get(ftype, numpy.float64))
+                self.pv_read_latency[key] = time.time() - t0
+                continue
+            ca.get(chid, count=count, wait=False)   # request is queued, not sent
+            pending[key] = pv_spec, chid, count
+        ca.flush_io()                       # send all requests together
+
+        for key, (pv_spec, chid, count) in pending.items():
+            value = ca.get_complete(
+                chid,
+                count=count,
+                as_string=pv_spec.as_string,
+                timeout=max(deadline - time.time(), 0.001),
+            )
+            self.pv_read_latency[key] = time.time() - t0
             if value is None:
-                value = NO_DATA_TEXT
-            if not isinstance(value, numpy.ndarray):
-                value = [value]
-            else:
-                if pv_spec.length_limit and pv_spec.length_limit in self.mgr.pv_registry:
-                    length_limit = self.mgr.pv_registry[pv_spec.length_limit].ophyd_signal.get()
-                    if len(value) > length_limit:
-                        value = value[:length_limit]
+                logger.warning(
+                    "%s(): timeout reading PV %s",
+                    caller, pv_spec.pvname
+                )
+            values[key] = value
+        return values
 
-            hdf5_parent = pv_spec.group_parent.hdf5_group
-            try:
-                logger.debug(f"saveFile(name=\"{pv_spec.label}\", data={value})")
-                ds = makeDataset(hdf5_parent, pv_spec.label, value)
-                self._attachEpicsAttributes(ds, pv_spec)
-                addAttributes(ds, **pv_spec.attrib)
-            except Exception as e:
-                logger.debug("saveFile():")
-                logger.debug("ERROR: pv_spec.label=%s, value=%s", pv_spec.label, str(value))
-                logger.debug("MESSAGE: %s", e)
-                logger.debug("RESOLUTION: writing as error message string")
-                makeDataset(hdf5_parent, pv_spec.label, [str(e).encode('utf8')])
+    def _write_pv_value(self, pv_spec, value, values, caller):
+        """
+        write one PV value (as read by ``_read_pv_values()``) to the file
 
-        # as the final step, make all the links as directed
-        for _k, v in self.mgr.link_registry.items():
-            v.make_link(f)
+        :param PV_Specification pv_spec: PV to be written
+        :param obj value: value read from EPICS
+        :param dict values: all values read together with this one
+        :param str caller: name of calling method, for log messages
+        """
+        if value is None:
+            value = NO_DATA_TEXT
+        if not isinstance(value, numpy.ndarray):
+            value = scalar_array(value)
+        else:
+            # native dtype, no copy: a slice is a view of the CA buffer
+            lim = pv_spec.length_limit
+            pv_reg = self.mgr.pv_registry
+            if lim and lim in pv_reg:
+                length_limit = values.get(lim)
+                if not isinstance(length_limit, (int, float, numpy.number)):
+                    length_limit = pv_reg[lim].ophyd_signal.get()
+                length_limit = int(length_limit)
+                if len(value) > length_limit:
+                    value = value[:length_limit]
 
-        f.close()    # be CERTAIN to close the file
-        logger.debug("saveFile(): file closed")
+        hdf5_parent = pv_spec.group_parent.hdf5_group
+        t0 = time.time()
+        try:
+            logger.debug('%s(name="%s", data=%s)', caller, pv_spec.label, value)
+            ds = makeDataset(hdf5_parent, pv_spec.label, value, storage=pv_spec.storage)
+            if ds is None:
+                logger.debug(f"Could not create {pv_spec.label}")
+                return
+            self._attachEpicsAttributes(ds, pv_spec)
+            addAttributes(ds, **pv_spec.attrib)
+        except Exception as e:
+            logger.debug("%s():", caller)
+            logger.debug("ERROR: pv_spec.label=%s, value=%s", pv_spec.label, str(value))
+            logger.debug("MESSAGE: %s", e)
+            logger.debug("RESOLUTION: writing as error message string")
+            makeDataset(hdf5_parent, pv_spec.label, [str(e).encode('utf8')])
+        finally:
+            self.pv_write_time[pv_spec.hdf5_path] = time.time() - t0
+
+    def _open_hdf5_file(self, mode, **kwargs):
+        """open the HDF5 file, in the writer process if there is one"""
+        if self.writer is None:
+            return h5py.File(self.hdf5_file_name, mode, **kwargs)
+        return self.writer.File(self.hdf5_file_name, mode, **kwargs)
 
     def _get_support_code_dir(self):
         return os.path.split(os.path.abspath(__file__))[0]
@@ -213,22 +648,45 @@ class SaveFlyScan(object):
                 # raise EpicsNotConnected()
                 break
             time.sleep(0.1)
+        self._timing_phase("connect")
 
         # create the file
+        if self.use_skeleton and self.mgr.config_hash is not None:
+            try:
+                self._create_file_from_skeleton()
+                self._timing_phase("prepare")
+                return
+            except Exception as exc:
+                logger.warning("could not create %s from skeleton: %s", self.hdf5_file_name, exc)
+        f = self._open_hdf5_file("w", **self._hdf5_file_kwargs())
+        self._write_root_attributes(f)
+        self._write_file_structure(f)
+        self._timing_phase("prepare")
+
+    def _hdf5_file_kwargs(self):
+        """keyword arguments to create the HDF5 file"""
+        if self.streaming:
+            # SWMR needs the latest HDF5 file format
+            return dict(libver="latest")
+        return {}
+
+    def _write_root_attributes(self, f):
+        """write the attributes that describe this file"""
+        # the following are attributes to the root element of the HDF5 file
+        root_attrs = {}
+        root_attrs["file_name"] = self.hdf5_file_name
+        root_attrs["creator"] = __file__
+        root_attrs["creator_version"] = self.creator_version
+        root_attrs["creator_config_file"] = self.config_file
+        root_attrs["HDF5_Version"] = h5py.version.hdf5_version
+        root_attrs["h5py_version"] = h5py.version.version
+        # root_attrs["NX_class"] = "NXroot",    # not illegal, *never* used
+        addAttributes(f, **root_attrs)
+
+    def _write_file_structure(self, f):
+        """create all groups and constant fields (all static content) in HDF5 file ``f``"""
         for key, xture in sorted(self.mgr.group_registry.items()):
             if key == '/':
-                # create the file and internal structure
-                f = h5py.File(self.hdf5_file_name, "w")
-                # the following are attributes to the root element of the HDF5 file
-                root_attrs = {}
-                root_attrs["file_name"] = self.hdf5_file_name
-                root_attrs["creator"] = __file__
-                root_attrs["creator_version"] = self.creator_version
-                root_attrs["creator_config_file"] = self.config_file
-                root_attrs["HDF5_Version"] = h5py.version.hdf5_version
-                root_attrs["h5py_version"] = h5py.version.version
-                # root_attrs["NX_class"] = "NXroot",    # not illegal, *never* used
-                addAttributes(f, **root_attrs)
                 xture.hdf5_group = f
             else:
                 hdf5_parent = xture.group_parent.hdf5_group
@@ -249,12 +707,52 @@ class SaveFlyScan(object):
                 )
                 raise Exception(msg)
 
+    def _attach_hdf5_groups(self, f):
+        """connect each group specification with its group in open HDF5 file ``f``"""
+        for key, xture in self.mgr.group_registry.items():
+            if key == '/':
+                xture.hdf5_group = f
+            else:
+                xture.hdf5_group = f[key]
+
+    def _skeleton_file(self):
+        """
+        name of the skeleton file for this configuration
+
+        The skeleton is an HDF5 file with all the static content:
+        groups, their attributes, and the constant fields.
+        """
+        key = hashlib.sha256()
+        for part in (
+                self.skeleton_version,
+                self.mgr.config_hash,
+                self._hdf5_file_kwargs(),
+                h5py.version.hdf5_version,
+                h5py.version.version,
+                ):
+            key.update(repr(part).encode())
+        return os.path.join(nexus.CONFIG_CACHE_DIR, key.hexdigest() + ".h5")
+
+    def _create_file_from_skeleton(self):
+        """copy the skeleton file (make it first, if needed), then open the copy"""
+        skeleton = self._skeleton_file()
+        if not os.path.exists(skeleton):
+            os.makedirs(os.path.dirname(skeleton), exist_ok=True)
+            tmp_file = f"{skeleton}.{os.getpid()}"
+            with h5py.File(tmp_file, "w", **self._hdf5_file_kwargs()) as f:
+                self._write_file_structure(f)
+            os.replace(tmp_file, skeleton)    # atomic
+            logger.debug("created skeleton file: %s", skeleton)
+
+        shutil.copyfile(skeleton, self.hdf5_file_name)
+        f = self._open_hdf5_file("r+", **self._hdf5_file_kwargs())
+        self._write_root_attributes(f)
+        self._attach_hdf5_groups(f)
+
     def _attachEpicsAttributes(self, node, pv):
         '''attach common attributes from EPICS to the HDF5 tree node'''
-        if hasattr(pv.ophyd_signal, "desc"):
-            desc = pv.ophyd_signal.desc.value
-        else:
-            desc = ''
+        # from the metadata cache, updated by CA events (see nexus.signal_metadata)
+        desc = pv.description
 
         attr = {}
         attr["epics_pv"] = pv.pvname.encode('utf8')
@@ -272,7 +770,7 @@ class SaveFlyScan(object):
         addAttributes(node, **attr)
 
 
-def makeDataset(parent, name, data = None, **attr):
+def makeDataset(parent, name, data = None, storage = None, **attr):
     '''
     create and write data to a dataset in the HDF5 file hierarchy
 
@@ -282,28 +780,28 @@ def makeDataset(parent, name, data = None, **attr):
     :param obj parent: parent group
     :param str name: valid NeXus dataset name
     :param obj data: the information to be written
+    :param dict storage: HDF5 storage options (chunks, compression,
+        compression_opts, shuffle) for array data,
+        see ``nexus.PV_Specification``
     :param dict attr: optional dictionary of attributes
     :return: h5py dataset object
 
     # note: Does dataset compression make smaller files?
+    # Measure with representative data before choosing:
     #
-    # ===========  =================
-    # compression  file size (bytes)
-    # ===========  =================
-    # None         362756
-    # gzip         815366
-    # lzf          861396
-    # ===========  =================
+    #     python ./benchmark_saveFlyData.py compression
     '''
     if data is None:
         obj = parent.create_dataset(name)
     else:
         try:
-            if len(data) == 1 and isinstance(data[0], str):
-                data = [numpy.string_(data[0])]
-                # logger.debug("converting [string] to [numpy.string_]")
-            logger.debug(f"makeDataset(name='{name}', data={data})")
-            obj = parent.create_dataset(name, data=data)
+            if not isinstance(data, numpy.ndarray):
+                if len(data) == 1:
+                    data = scalar_array(data[0])
+                # logger.debug("converting [scalar] to numpy array")
+            logger.debug("makeDataset(name='%s', data=%s)", name, data)
+            # numpy arrays are written as-is: their dtype is kept, no copy is made
+            obj = parent.create_dataset(name, data=data, **_storage_options(data, storage))
         except TypeError as _exc:
             logger.debug(f"Could not save name = {name} : {_exc}")
             obj = None
@@ -312,13 +810,59 @@ def makeDataset(parent, name, data = None, **attr):
             logger.debug(f"Unexpected Exception: {name} : {_exc}")
             obj = None
 
-        #obj = parent.create_dataset(name, data=data, compression="gzip")
-        #obj = parent.create_dataset(name, data=data, compression="lzf")
     if obj is not None:
         addAttributes(obj, **attr)
     return obj
 
 
+def scalar_array(value):
+    """
+    return a scalar value as a 1-element numpy array of fixed dtype
+
+    ======================  ===============================
+    value                   dtype
+    ======================  ===============================
+    str, bytes              fixed-length bytes (UTF-8)
+    bool                    bool
+    int                     int64
+    float                   float64
+    numpy scalar            the same dtype
+    ======================  ===============================
+
+    Other values are left to numpy.
+    """
+    if isinstance(value, str):
+        value = value.encode('utf8')
+    if isinstance(value, bytes):
+        return numpy.array([value], dtype=f"S{max(len(value), 1)}")
+    if isinstance(value, numpy.generic):
+        return numpy.array([value], dtype=value.dtype)
+    if isinstance(value, bool):
+        return numpy.array([value], dtype=numpy.bool_)
+    if isinstance(value, int):
+        return numpy.array([value], dtype=numpy.int64)
+    if isinstance(value, float):
+        return numpy.array([value], dtype=numpy.float64)
+    return numpy.array([value])
+
+
+def _storage_options(data, storage):
+    """
+    HDF5 storage options to use for ``data``
+
+    Small data (scalars, wrapped as ``[value]``) stay contiguous.
+    The chunk size is limited to the length of the data.
+    """
+    if not storage or not isinstance(data, numpy.ndarray) or data.ndim != 1:
+        return {}
+    if len(data) <= 1:
+        return {}
+    options = dict(storage)
+    if "chunks" in options:
+        options["chunks"] = (min(options["chunks"][0], len(data)),)
+    return options
+
+
 def addAttributes(parent, **attr):
     """
     add attributes to an h5py data item
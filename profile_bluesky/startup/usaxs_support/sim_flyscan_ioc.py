@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+simulated IOC serving all the PVs named in a saveFlyData.xml file
+
+Used to develop and time the fly scan support code
+(``saveFlyData.py`` and ``nexus.py``) away from the instrument.
+
+* every ``<PV>`` in the XML configuration is served
+* non-field PVs also get a ``.DESC`` field (see ``nexus.desc_pool``)
+* ``string="true"`` PVs are served as strings
+* PVs with a ``length_limit`` (or named ``changes_*``) are served as arrays
+* the trigger and timeout PVs are served
+* the status PVs written by ``saveFlyData.SaveFlyScan.waitForData()`` are served
+
+USAGE::
+
+    python ./sim_flyscan_ioc.py --list-pvs
+    python ./sim_flyscan_ioc.py saveFlyData.xml
+
+Requires the ``caproto`` package.
+"""
+
+import logging
+import numpy
+import os
+
+from caproto import ChannelDouble, ChannelInteger, ChannelString
+from lxml import etree as lxml_etree
+
+
+logger = logging.getLogger(os.path.split(__file__)[-1])
+
+path = os.path.dirname(__file__)
+XML_CONFIGURATION_FILE = os.path.join(path, 'saveFlyData.xml')
+DEFAULT_ARRAY_LENGTH = 8000     # channels in simulated MCA arrays
+FLY_SCAN_NOT_SAVED_PV = '9idcLAX:USAXS:FlyScanNotSaved'     # as in saveFlyData.py
+SCAN_TIME_PV = '9idcLAX:USAXS:FS_ScanTime'                  # as in saveFlyData.py
+
+
+def build_pvdb(config_file, array_length=DEFAULT_ARRAY_LENGTH):
+    """
+    create the caproto PV database from the XML configuration file
+
+    :param str config_file: saveFlyData.xml configuration file
+    :param int array_length: number of elements in each simulated array
+    :return: dict of caproto ChannelData objects, keyed by PV name
+    """
+    root = lxml_etree.parse(config_file).getroot()
+    pvdb = {}
+
+    node = root.xpath('/saveFlyData/triggerPV')[0]
+    pvdb[node.attrib['pvname']] = ChannelInteger(value=int(node.attrib['done_value']))
+    pvdb[node.attrib['pvname'] + ".DESC"] = ChannelString(value="triggerPV")
+    node = root.xpath('/saveFlyData/timeoutPV')[0]
+    pvdb[node.attrib['pvname']] = ChannelDouble(value=60.0)
+    pvdb[node.attrib['pvname'] + ".DESC"] = ChannelString(value="timeoutPV")
+
+    for node in root.xpath('//PV'):
+        pvname = node.attrib['pvname']
+        label = node.attrib['label']
+        if pvname in pvdb:
+            continue
+        if node.get('string', 'false').lower() in ('t', 'true'):
+            pvdb[pvname] = ChannelString(value=label)
+        elif node.get('length_limit') is not None or label.startswith('changes_'):
+            data = numpy.arange(array_length, dtype=numpy.int32)
+            pvdb[pvname] = ChannelInteger(value=data, max_length=array_length)
+        elif label.endswith(("_count", "_channels")):
+            pvdb[pvname] = ChannelInteger(value=array_length)
+        else:
+            pvdb[pvname] = ChannelDouble(value=0.0)
+        if pvname.find(".") < 0:
+            pvdb[pvname + ".DESC"] = ChannelString(value=label)
+
+    if FLY_SCAN_NOT_SAVED_PV not in pvdb:
+        pvdb[FLY_SCAN_NOT_SAVED_PV] = ChannelInteger(value=0)
+    if SCAN_TIME_PV not in pvdb:
+        pvdb[SCAN_TIME_PV] = ChannelDouble(value=60.0)
+    return pvdb
+
+
+def _set_tcp_nodelay():
+    """
+    send small CA replies at once, as an EPICS IOC (rsrv) does
+
+    The caproto asyncio server leaves Nagle's algorithm on for its
+    client sockets.  Several small replies to one batch of requests
+    (such as count-limited array reads) then wait for delayed ACKs
+    (about 40 ms), which a real IOC does not do.
+    """
+    import socket
+    from caproto.asyncio import utils
+
+    init = utils._TransportWrapper.__init__
+
+    def _init(self, reader, writer):
+        init(self, reader, writer)
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    utils._TransportWrapper.__init__ = _init
+
+
+def get_CLI_options():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+
+    parser.add_argument('xml_config_file',
+                    action='store',
+                    nargs='?',
+                    default=XML_CONFIGURATION_FILE,
+                    help="XML configuration file")
+
+    parser.add_argument('--array-length',
+                    action='store',
+                    type=int,
+                    default=DEFAULT_ARRAY_LENGTH,
+                    help="number of elements in simulated arrays")
+
+    parser.add_argument('--list-pvs',
+                    action='store_true',
+                    help="print the PV names and exit")
+
+    return parser.parse_args()
+
+
+def main():
+    from caproto.asyncio.server import run
+
+    cli_options = get_CLI_options()
+    pvdb = build_pvdb(cli_options.xml_config_file, cli_options.array_length)
+    if cli_options.list_pvs:
+        print("\n".join(sorted(pvdb)))
+        return
+    logger.info("serving %d PVs from %s", len(pvdb), cli_options.xml_config_file)
+    _set_tcp_nodelay()
+    run(pvdb, interfaces=['0.0.0.0'], log_pv_names=False)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,11 @@
+"""
+tests of the usaxs_support modules (no EPICS, no bluesky session)
+
+The modules import each other as standalone scripts,
+as when run from this directory.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,25 @@
+"""
+tests of flyscan_handler: the databroker handler of fly scan arrays
+"""
+
+import h5py
+import numpy
+
+import flyscan_handler
+
+
+def test_read_then_write(tmp_path):
+    """reading an array must not keep the file from being opened r+"""
+    fname = str(tmp_path / "flyscan.h5")
+    mca1 = numpy.arange(100, dtype=numpy.uint32)
+    with h5py.File(fname, "w") as f:
+        f["entry/flyScan/mca1"] = mca1
+
+    handler = flyscan_handler.FlyScanHDF5Handler(fname)
+    numpy.testing.assert_array_equal(handler("/entry/flyScan/mca1"), mca1)
+
+    with h5py.File(fname, "r+") as f:     # as NXWriterFlyScan does
+        f["entry/title"] = "written"
+    numpy.testing.assert_array_equal(handler("/entry/flyScan/mca1"), mca1)
+    assert handler.get_file_list([]) == [fname]
+    handler.close()
@@ -0,0 +1,89 @@
+"""
+tests of flyscan_master: the session master (index) file
+"""
+
+import h5py
+import logging
+import numpy
+import pytest
+
+import flyscan_master
+
+
+def make_scan(path, mca1, n=100):
+    """write a minimal fly scan file, ``mca1`` may be a placeholder string"""
+    with h5py.File(path, "w") as f:
+        fs = f.create_group("entry/flyScan")
+        fs["mca1"] = mca1
+        fs["mca2"] = numpy.arange(n, dtype=numpy.uint32)
+        f["entry/title"] = path.stem
+    return str(path)
+
+
+def read_master(master_file):
+    with h5py.File(master_file, "r") as master:
+        data = master["entry/data"]
+        return {
+            "mca1": data["mca1"][()],
+            "mca1_channels": data["mca1_channels"][()],
+            "mca2": data["mca2"][()],
+        }
+
+
+@pytest.mark.parametrize("placeholder_first", [True, False])
+def test_string_placeholder(tmp_path, caplog, placeholder_first):
+    """saveFlyData writes a string when a PV is missing: 0 channels"""
+    master = flyscan_master.FlyScanMasterFile(tmp_path / "master.h5")
+    good = numpy.arange(1, 101, dtype=numpy.uint32)
+    scans = ["not connected", good]
+    if not placeholder_first:
+        scans.reverse()
+
+    with caplog.at_level(logging.WARNING):
+        for i, mca1 in enumerate(scans):
+            assert master.add_scan(make_scan(tmp_path / f"s_{i+1:04d}.h5", mca1)) == i + 1
+    assert "not a numeric array" in caplog.text
+
+    data = read_master(master.master_file)
+    bad, ok = (0, 1) if placeholder_first else (1, 0)
+    assert data["mca1"].dtype.kind == "u"
+    assert data["mca1_channels"][bad] == 0
+    assert data["mca1_channels"][ok] == 100
+    numpy.testing.assert_array_equal(data["mca1"][ok], good)
+    numpy.testing.assert_array_equal(data["mca2"][bad], numpy.arange(100))
+
+
+def test_string_array_placeholder(tmp_path, caplog):
+    """1-D array of strings is not numeric either"""
+    master = flyscan_master.FlyScanMasterFile(tmp_path / "master.h5")
+    with caplog.at_level(logging.WARNING):
+        master.add_scan(make_scan(tmp_path / "s_0001.h5", numpy.array([b"no data"] * 3)))
+        master.add_scan(make_scan(tmp_path / "s_0002.h5", numpy.ones(5, dtype=numpy.uint32)))
+    data = read_master(master.master_file)
+    numpy.testing.assert_array_equal(data["mca1_channels"], [0, 5])
+    numpy.testing.assert_array_equal(data["mca1"][1], numpy.ones(5))
+
+
+def test_dtype_mismatch_skipped(tmp_path, caplog):
+    """an array of another dtype than recorded is not mapped"""
+    master = flyscan_master.FlyScanMasterFile(tmp_path / "master.h5")
+    with caplog.at_level(logging.WARNING):
+        master.add_scan(make_scan(tmp_path / "s_0001.h5", numpy.ones(5, dtype=numpy.uint32)))
+        master.add_scan(make_scan(tmp_path / "s_0002.h5", numpy.ones(5, dtype=numpy.float64)))
+    assert "is not <u4" in caplog.text
+    data = read_master(master.master_file)
+    numpy.testing.assert_array_equal(data["mca1_channels"], [5, 0])
+
+
+def test_blocks(tmp_path):
+    """more scans than one block: full blocks copied, contents unchanged"""
+    master = flyscan_master.FlyScanMasterFile(tmp_path / "master.h5")
+    num_scans = 2 * flyscan_master.BLOCK_SIZE + 3
+    for i in range(num_scans):
+        mca1 = numpy.arange(10 + i, dtype=numpy.uint32)
+        master.add_scan(make_scan(tmp_path / f"s_{i+1:04d}.h5", mca1))
+    data = read_master(master.master_file)
+    assert data["mca1"].shape == (num_scans, 10 + num_scans - 1)
+    for i in range(num_scans):
+        assert data["mca1_channels"][i] == 10 + i
+        numpy.testing.assert_array_equal(data["mca1"][i, :10 + i], numpy.arange(10 + i))
@@ -4,8 +4,21 @@
 Step-Size Algorithm for Bonse-Hart Ultra-Small-Angle Scattering Instruments
 
 :see: https://www.jemian.org/SAS/ustep.pdf
+
+USAGE::
+
+    python ./ustep.py               # example series
+    python ./ustep.py benchmark     # time to find the series, 200 .. 10,000 points
 '''
 
+import functools
+import numpy
+import time
+
+
+CACHE_SIZE = 128
+MAX_STEP = 1e100    # steps further than this from center are this size
+
 
 class Ustep(object):
     '''
@@ -18,9 +31,9 @@ class Ustep(object):
     :param float exponent: :math:`\eta`, exponential factor
     :param float minStep: smallest allowed step size
     :param float factor: :math:`k`, multiplying factor (computed internally)
-    
+
     EXAMPLE:
-    
+
         start = 10.0
         center = 9.5
         finish = 7
@@ -41,9 +54,11 @@ class Ustep(object):
         motor_trajectory = ar_trajectory + ay_trajectory + dy_trajectory
 
         RE(scan_nd([detector], motor_trajectory)
-    
+
+    The factor and the series are memoized (keyed by all the
+    parameters), a new ``Ustep`` with the same parameters costs nothing.
     '''
-    
+
     def __init__(self, start, center, finish, numPts, exponent, minStep):
         self.start = start
         self.center = center
@@ -53,53 +68,18 @@ class Ustep(object):
         self.minStep = minStep
         self.sign = {True: 1, False: -1}[start < finish]
         self.factor = self._find_factor_()
-        
+
     def _find_factor_(self):
         '''
         Determine the factor that will make a series with the specified parameters.
-        
-        Consider recent history when refining choice.
-        '''
-        
-        def assess_diff(factor):
-            series = self.series(factor)
-            diff = abs(series[0] - series[-1]) - span_target
-            return diff
-            
-        span_target = abs(self.finish - self.start)
-        span_precision = abs(self.minStep) * 0.2
-        factor = abs(self.finish-self.start) / (self.numPts -1)
-        diff = assess_diff(factor)
-        f = [factor, factor]
-        d = [diff, diff]
-        
-        # first make certain that d[0] < 0 and d[1] > 0, expand f[0] and f[1]
-        for _ in range(100):
-            if d[0] * d[1] < 0:
-                break           # now, d[0] and d[1] have opposite sign
-            factor *= {True: 2, False: 0.5}[diff < 0]
-            diff = assess_diff(factor)
-            key = {True: 1, False: 0}[diff > d[1]]
-            f[key] = factor
-            d[key] = diff
-            # print(f"expand: diff={diff} key={key}  factor={factor} last={self.series(factor)[-1]}")
-        
-        # now: d[0] < 0 and d[1] > 0, squeeze f[0] & f[1] to converge
-        for _ in range(100):
-            if (d[1] - d[0]) > span_target:
-                factor = (f[0] + f[1])/2              # bracket by bisection when not close
-            else:
-                factor = f[0] - d[0] * (f[1]-f[0])/(d[1]-d[0])    # linear interpolation when close
-            diff = assess_diff(factor)
-            if abs(diff) <= span_precision:
-                break
-            key = {True: 0, False: 1}[diff < 0]
-            f[key] = factor
-            d[key] = diff
-            # print(f"squeeze: diff={diff} key={key}  factor={factor} last={self.series(factor)[-1]}")
 
+        Depends only on the parameters (memoized).
+        '''
+        factor, _series = _solve(
+            self.start, self.center, self.finish,
+            self.numPts, self.exponent, self.minStep)
         return factor
-    
+
     def stepper(self, factor=None):
         """
         generator: series of angle steps
@@ -109,14 +89,8 @@ class Ustep(object):
 
         :param float factor: :math:`k`, multiplying factor (computed internally)
         """
-        x = self.start
-        for i in range(self.numPts):
-            x += self.sign * self._calc_next_step_(x, factor or self.factor)
-            if i == self.numPts-1 and factor is None:
-                yield self.finish
-            else:
-                yield x
-    
+        yield from self.series(factor)
+
     def series(self, factor=None):
         """
         create a series with the given factor
@@ -126,19 +100,168 @@ class Ustep(object):
 
         :param float factor: :math:`k`, multiplying factor (computed internally)
         """
-        return [x for x in self.stepper(factor)]
-    
+        if factor is None:
+            _factor, series = _solve(
+                self.start, self.center, self.finish,
+                self.numPts, self.exponent, self.minStep)
+            return list(series)
+        return _series(
+            self.start, self.center, self.sign,
+            self.numPts, self.exponent, self.minStep, factor)
+
     def _calc_next_step_(self, x, factor):
         """
         Calculate the next step size with the given parameters
         """
-        if abs(x - self.center) > 1e100:
-            step = 1e100
+        if abs(x - self.center) > MAX_STEP:
+            step = MAX_STEP
         else:
             step = factor * pow( abs(x - self.center), self.exponent ) + self.minStep
         return step
 
 
+def _series(start, center, sign, numPts, exponent, minStep, factor):
+    """
+    series of positions (list), stepping from ``start`` with ``factor``
+
+    Each position depends on the previous one: this loop cannot
+    be vectorized, it is kept as short as possible.
+    """
+    positions = [0.0] * numPts
+    x = start
+    for i in range(numPts):
+        d = abs(x - center)
+        if d > MAX_STEP:
+            x += sign * MAX_STEP
+        else:
+            x += sign * (factor * d**exponent + minStep)
+        positions[i] = x
+    return positions
+
+
+def _estimate_factor(start, center, finish, numPts, exponent, minStep):
+    """
+    estimate the factor from a continuous model of the steps (NumPy)
+
+    With step :math:`s(u) = k u^\eta + m` at distance :math:`u` from
+    ``center``, there are :math:`\int du / s(u)` steps between two
+    positions.  Evaluated for many :math:`k` at once, the :math:`k`
+    giving ``numPts-1`` steps is interpolated.
+    """
+    span = abs(finish - start)
+    guess = span / (numPts - 1)
+    factors = guess * numpy.logspace(-8, 8, 97)
+    minStep = abs(minStep) or span * 1e-12
+
+    def steps_within(distance):
+        """number of steps (for each factor) from center to ``distance``"""
+        u = distance * numpy.concatenate(([0], numpy.geomspace(1e-9, 1, 128)))
+        density = 1 / (factors[numpy.newaxis, :] * (u**exponent)[:, numpy.newaxis] + minStep)
+        return ((density[1:] + density[:-1]) * numpy.diff(u)[:, numpy.newaxis]).sum(axis=0) / 2
+
+    n_start = steps_within(abs(start - center))
+    n_finish = steps_within(abs(finish - center))
+    if (start - center) * (finish - center) <= 0:
+        n = n_start + n_finish      # crosses the center
+    else:
+        n = abs(n_finish - n_start)
+    # n decreases with the factor: reverse both for numpy.interp
+    target = numPts - 1
+    if not n[-1] <= target <= n[0] or n[-1] <= 0:
+        return guess
+    log_factor = numpy.interp(
+        numpy.log(target), numpy.log(n[::-1]), numpy.log(factors[::-1]))
+    return float(numpy.exp(log_factor))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _solve(start, center, finish, numPts, exponent, minStep):
+    """
+    find the factor (memoized), return ``(factor, series)``
+
+    Regula falsi (Illinois) from the continuous estimate,
+    usually a few evaluations of the series.  The result depends
+    only on the arguments (no state kept between calls).
+    The last position of the series (a tuple) is ``finish``.
+    """
+    sign = {True: 1, False: -1}[start < finish]
+    span_target = abs(finish - start)
+    span_precision = abs(minStep) * 0.2
+
+    evaluated = {}  # factor: series, the last one evaluated
+
+    def assess_diff(factor):
+        series = _series(start, center, sign, numPts, exponent, minStep, factor)
+        evaluated.clear()
+        evaluated[factor] = series
+        return abs(series[0] - series[-1]) - span_target
+
+    factor = _estimate_factor(start, center, finish, numPts, exponent, minStep)
+    diff = assess_diff(factor)
+    f = [factor, factor]
+    d = [diff, diff]
+
+    # bracket: d[0] < 0 and d[1] > 0, by secant steps (10% beyond)
+    # from the estimate and a factor 1% away
+    trial = factor * (1.01 if diff < 0 else 1 / 1.01)
+    for _ in range(100):
+        if d[0] < 0 < d[1] or abs(diff) <= span_precision:
+            break
+        last_factor, last_diff = factor, diff
+        factor = trial
+        diff = assess_diff(factor)
+        if diff < 0:
+            if d[0] >= 0 or diff > d[0]:
+                f[0], d[0] = factor, diff
+        elif d[1] <= 0 or diff < d[1]:
+            f[1], d[1] = factor, diff
+        if diff == last_diff or abs(diff) > span_target:
+            trial = factor * (2 if diff < 0 else 0.5)     # far: not linear
+        else:
+            step = -1.1 * diff * (factor - last_factor) / (diff - last_diff)
+            trial = min(max(factor + step, factor / 4), factor * 4)
+
+    # squeeze f[0] & f[1] to converge
+    side = 0
+    for _ in range(100):
+        if abs(diff) <= span_precision:
+            break
+        if (d[1] - d[0]) > span_target:
+            factor = (f[0] + f[1]) / 2      # bisection when not close
+        else:
+            factor = f[0] - d[0] * (f[1] - f[0]) / (d[1] - d[0])
+        diff = assess_diff(factor)
+        key = {True: 0, False: 1}[diff < 0]
+        f[key], d[key] = factor, diff
+        if key == side:
+            d[1 - key] /= 2     # Illinois: same side twice, halve the other end
+        side = key
+
+    series = evaluated.get(factor)
+    if series is None:
+        series = _series(start, center, sign, numPts, exponent, minStep, factor)
+    series[-1] = finish
+    return factor, tuple(series)
+
+
+def benchmark(sizes=(200, 500, 1000, 2000, 5000, 10000), repeat=3):
+    """print the time to find the factor & series (not memoized, then memoized)"""
+    print(f"{'points':>8}  {'solve, ms':>10}  {'memoized, ms':>12}  {'span error':>10}")
+    for n in sizes:
+        args = (10.8, 10.0, 9.0, n, 1.2, 0.0001)
+        times = []
+        for _ in range(repeat):
+            _solve.cache_clear()
+            t0 = time.time()
+            u = Ustep(*args)
+            times.append(time.time() - t0)
+        t0 = time.time()
+        series = Ustep(*args).series()
+        t_memo = time.time() - t0
+        error = abs(series[0] - u.series(u.factor)[-1]) - abs(args[2] - args[0])
+        print(f"{n:8d}  {min(times)*1000:10.2f}  {t_memo*1000:12.4f}  {error:10.2g}")
+
+
 def main():
     start = 10.0
     center = 9.5
@@ -147,11 +270,14 @@ def main():
     exponent = 1.2
     minStep = 0.0001
     u = Ustep(start, center, finish, numPts, exponent, minStep)
-
     print(f"factor={u.factor} for {len(u.series())} points")
     for i, angle in enumerate(u.stepper()):
         print(i, angle)
 
 
 if __name__ == '__main__':
-    main()
+    import sys
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+"""
+choose the Ustep parameters (points, exponent, minStep) of a USAXS step scan
+
+Two kinds of budget:
+
+``time_budget_s``
+    As many points as fit in the time (``uascan()`` count times,
+    plus an overhead per point), then the exponent and minStep
+    that give the best (smallest) ΔQ/Q.
+``dq_over_q``
+    The fewest points (the shortest scan) with ΔQ/Q no larger
+    than this, at all Q above ``q_min``.
+
+All (exponent, minStep) candidates of a point count are compared
+at once, as one 2-D NumPy array.  The Ustep series are memoized.
+
+USAGE::
+
+    python ./ustep_planner.py --time 300 10.8 10.0 9.0 1.0
+    python ./ustep_planner.py --dq 0.05 10.8 10.0 9.0 1.0
+
+PUBLIC
+
+    ~count_times
+    ~predict_duration
+    ~q_values
+    ~plan_uascan
+"""
+
+import logging
+import numpy
+import os
+
+try:
+    from ustep import Ustep     # when run standalone
+except ImportError:
+    from .ustep import Ustep    # when imported in a package
+
+
+logger = logging.getLogger(os.path.split(__file__)[-1])
+
+POINT_OVERHEAD_S = 1.0      # motor moves, scaler start & readout (estimated)
+Q_MIN = 1e-4                # 1/A, ΔQ/Q is judged above this Q
+DEFAULT_EXPONENTS = numpy.linspace(1.0, 1.6, 13)
+MIN_POINTS = 20
+MAX_POINTS = 2000
+
+
+def count_times(intervals, count_time, dynamic=True):
+    """
+    count time (s) at each point of ``uascan()``
+
+    :param int intervals: number of points
+    :param float count_time: base count time (s)
+    :param bool dynamic: ``useDynamicTime`` (1/3, 1, 2 times the base)
+    """
+    fraction = numpy.arange(intervals) / intervals
+    if not dynamic:
+        return numpy.full(intervals, float(count_time))
+    return count_time * numpy.select(
+        [fraction < 0.33, fraction < 0.66], [1 / 3, 1], 2)
+
+
+def predict_duration(intervals, count_time, dynamic=True, overhead_s=POINT_OVERHEAD_S):
+    """
+    predicted time (s) of ``uascan()``, for one or an array of ``intervals``
+
+    Same count time rule as ``count_times()``, without building the arrays.
+    """
+    n = numpy.asarray(intervals, dtype=float)
+    if dynamic:
+        def below(fraction):
+            """number of points i with i/n < fraction"""
+            k = numpy.floor(fraction * n)
+            return numpy.minimum(k + (k / n < fraction), n)
+
+        n1 = below(0.33)
+        n2 = below(0.66)
+        total = count_time * (n1 / 3 + (n2 - n1) + 2 * (n - n2))
+    else:
+        total = count_time * n
+    return total + overhead_s * n
+
+
+def q_values(positions, center, wavelength):
+    """Q (1/A) at AR ``positions`` (degrees), as in ``a2q_q2a.angle2q()``"""
+    angle = numpy.abs(numpy.asarray(positions) - center)
+    return (4 * numpy.pi / wavelength) * numpy.sin(angle * numpy.pi / 2 / 180)
+
+
+def _candidates(start, center, finish, intervals, exponents, min_steps):
+    """Ustep series (2-D array, one row each) of the usable candidates"""
+    span = abs(finish - start)
+    params, rows = [], []
+    for exponent in exponents:
+        for min_step in min_steps:
+            if min_step * (intervals - 1) >= span:
+                continue    # minStep alone would pass finish
+            try:
+                u = Ustep(start, center, finish, intervals, float(exponent), float(min_step))
+            except (ArithmeticError, ValueError):
+                continue
+            if u.factor <= 0:
+                continue
+            params.append((float(exponent), float(min_step), u.factor))
+            rows.append(u.series())
+    return params, numpy.array(rows)
+
+
+def _worst_dq_over_q(series, center, wavelength, q_min):
+    """largest ΔQ/Q (above ``q_min``) of each row of ``series``"""
+    q = q_values(series, center, wavelength)
+    dq = numpy.abs(numpy.diff(q, axis=1))
+    q_low = numpy.minimum(q[:, :-1], q[:, 1:])
+    judged = q_low >= q_min
+    ratio = numpy.where(judged, dq / numpy.where(judged, q_low, 1), 0)
+    return ratio.max(axis=1)
+
+
+def _best(start, center, finish, intervals, wavelength, exponents, min_steps, q_min):
+    """best candidate (smallest worst ΔQ/Q) with ``intervals`` points, or None"""
+    params, series = _candidates(start, center, finish, intervals, exponents, min_steps)
+    if len(params) == 0:
+        return None
+    worst = _worst_dq_over_q(series, center, wavelength, q_min)
+    i = int(numpy.argmin(worst))
+    exponent, min_step, factor = params[i]
+    return dict(
+        numPts=int(intervals),
+        exponent=exponent,
+        minStep=min_step,
+        factor=factor,
+        dq_over_q=float(worst[i]),
+        series=series[i],
+        candidates=len(params),
+    )
+
+
+def plan_uascan(
+        start, center, finish, wavelength, count_time,
+        time_budget_s=None, dq_over_q=None,
+        dynamic=True, overhead_s=POINT_OVERHEAD_S, q_min=Q_MIN,
+        exponents=DEFAULT_EXPONENTS, min_steps=None,
+        min_points=MIN_POINTS, max_points=MAX_POINTS):
+    """
+    choose the Ustep parameters for a time budget or a ΔQ/Q target
+
+    :param float start: first AR (degrees)
+    :param float center: AR at Q=0 (degrees)
+    :param float finish: last AR (degrees)
+    :param float wavelength: X-ray wavelength (A)
+    :param float count_time: base count time (s), as ``uascan()``
+    :param float time_budget_s: longest scan (s)
+    :param float dq_over_q: largest ΔQ/Q above ``q_min``
+        (used when both budgets are given, the plan reports
+        if it fits in ``time_budget_s``)
+    :param bool dynamic: ``useDynamicTime``
+    :param float overhead_s: time per point, besides counting (s)
+    :param float q_min: ΔQ/Q is judged above this Q (1/A)
+    :param [float] exponents: exponents to try
+    :param [float] min_steps: minStep values to try (degrees),
+        default: ``span * 1e-5`` .. ``span * 1e-3``
+    :return: dict: ``numPts``, ``exponent``, ``minStep``, ``factor``,
+        ``dq_over_q`` (worst), ``duration_s``, ``within_budget``,
+        ``series`` (AR), ``q``, ``count_time``
+        (arrays, one value per point)
+    :raises ValueError: no budget given, or no parameters meet it
+    """
+    span = abs(finish - start)
+    if min_steps is None:
+        min_steps = numpy.geomspace(span * 1e-5, span * 1e-3, 9)
+
+    points = numpy.arange(min_points, max_points + 1)
+    durations = predict_duration(points, count_time, dynamic, overhead_s)
+
+    def search(n):
+        return _best(start, center, finish, n, wavelength, exponents, min_steps, q_min)
+
+    if dq_over_q is not None:
+        # fewest points (ΔQ/Q decreases with more points): bisection
+        lo, hi = 0, len(points) - 1
+        best = search(points[hi])
+        if best is None or best["dq_over_q"] > dq_over_q:
+            raise ValueError(
+                f"ΔQ/Q={dq_over_q} not reached with {max_points} points")
+        while lo < hi:
+            mid = (lo + hi) // 2
+            trial = search(points[mid])
+            if trial is not None and trial["dq_over_q"] <= dq_over_q:
+                hi, best = mid, trial
+            else:
+                lo = mid + 1
+        if best["numPts"] != points[lo]:
+            best = search(points[lo])
+    elif time_budget_s is not None:
+        fits = numpy.flatnonzero(durations <= time_budget_s)
+        if len(fits) == 0:
+            raise ValueError(
+                f"{min_points} points take {durations[0]:.0f} s,"
+                f" more than {time_budget_s} s")
+        best = search(points[fits[-1]])
+        if best is None:
+            raise ValueError(f"no usable Ustep parameters with {points[fits[-1]]} points")
+    else:
+        raise ValueError("need time_budget_s or dq_over_q")
+
+    n = best["numPts"]
+    best["duration_s"] = float(predict_duration(n, count_time, dynamic, overhead_s))
+    best["within_budget"] = time_budget_s is None or best["duration_s"] <= time_budget_s
+    best["q"] = q_values(best["series"], center, wavelength)
+    best["count_time"] = count_times(n, count_time, dynamic)
+    return best
+
+
+def points_per_decade(q):
+    """number of points in each decade of Q: dict, key: decade (1/A)"""
+    q = numpy.asarray(q)
+    q = q[q > 0]
+    decades = numpy.floor(numpy.log10(q)).astype(int)
+    keys, counts = numpy.unique(decades, return_counts=True)
+    return {float(10.0**k): int(c) for k, c in zip(keys, counts)}
+
+
+def get_CLI_options():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+
+    parser.add_argument('start', action='store', type=float, help="first AR (degrees)")
+    parser.add_argument('center', action='store', type=float, help="AR at Q=0 (degrees)")
+    parser.add_argument('finish', action='store', type=float, help="last AR (degrees)")
+    parser.add_argument('count_time', action='store', type=float, help="base count time (s)")
+    parser.add_argument('--wavelength', action='store', type=float, default=0.59,
+                    help="wavelength (A), default: 0.59")
+    parser.add_argument('--time', action='store', type=float, dest='time_budget_s',
+                    help="time budget (s)")
+    parser.add_argument('--dq', action='store', type=float, dest='dq_over_q',
+                    help="largest ΔQ/Q")
+
+    return parser.parse_args()
+
+
+def main():
+    import time
+    args = get_CLI_options()
+    t0 = time.time()
+    plan = plan_uascan(
+        args.start, args.center, args.finish, args.wavelength, args.count_time,
+        time_budget_s=args.time_budget_s, dq_over_q=args.dq_over_q)
+    print(f"planned in {time.time()-t0:.2f} s")
+    for key in "numPts exponent minStep dq_over_q duration_s within_budget".split():
+        print(f"{key}: {plan[key]}")
+    for decade, n in points_per_decade(plan["q"]).items():
+        print(f"Q >= {decade:g} 1/A: {n} points")
+
+
+if __name__ == '__main__':
+    main()